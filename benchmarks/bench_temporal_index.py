@@ -0,0 +1,74 @@
+"""
+Compares the TemporalIndex lookups against the boolean-mask filtering the query engine
+used before, on a single dense (patient, LOINC) slice such as a long ICU stay.
+
+    python benchmarks/bench_temporal_index.py [rows] [queries]
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from temporal_db.temporal_index import TemporalIndex
+
+def make_slice(rows: int, seed: int = 0, stop_after: pd.Timedelta = None) -> pd.DataFrame:
+    """
+    One patient/code worth of minute-level measurements, ~10% of them corrected later.
+    Measurements are open-ended unless stop_after gives them a validity period.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2018-01-01') + pd.to_timedelta(np.sort(rng.integers(0, rows * 60, rows)), unit='s')
+    tx = start + pd.to_timedelta(rng.integers(60, 86400, rows), unit='s')
+    corrected = rng.random(rows) < 0.1
+    tx = tx.where(~corrected, tx + pd.Timedelta(days=3))
+    stop = start + stop_after if stop_after is not None else pd.Timestamp.max
+    return pd.DataFrame({'valid_start_time': start, 'valid_stop_time': stop, 'transaction_time': tx})
+
+def mask_valid_at(df, vt, tt):
+    known = df[df['transaction_time'] <= tt]
+    return known[(known['valid_start_time'] <= vt) & (known['valid_stop_time'] > vt)].index.to_numpy()
+
+def mask_started_within(df, vs, ve, tt):
+    known = df[df['transaction_time'] <= tt]
+    return known[(known['valid_start_time'] >= vs) & (known['valid_start_time'] < ve)].index.to_numpy()
+
+def timed(fn, args_list) -> float:
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+def run(rows: int, queries: int, stop_after: pd.Timedelta = None):
+    df = make_slice(rows, stop_after=stop_after)
+    index = TemporalIndex(np.arange(rows), df['valid_start_time'], df['valid_stop_time'], df['transaction_time'])
+
+    rng = np.random.default_rng(1)
+    lo, hi = df['valid_start_time'].min(), df['valid_start_time'].max()
+    points = [lo + (hi - lo) * f for f in rng.random(queries)]
+    point_args = [(vt, vt + pd.Timedelta(hours=12)) for vt in points]
+    range_args = [(vs, vs + pd.Timedelta(hours=6), vs + pd.Timedelta(days=1)) for vs in points]
+    np_point_args = [(vt.to_datetime64(), tt.to_datetime64()) for vt, tt in point_args]
+    np_range_args = [tuple(t.to_datetime64() for t in args) for args in range_args]
+
+    for (vt, tt), (nvt, ntt) in zip(point_args[:20], np_point_args[:20]):
+        assert np.array_equal(np.sort(mask_valid_at(df, vt, tt)), np.sort(index.valid_at(nvt, ntt)))
+    for args, nargs in zip(range_args[:20], np_range_args[:20]):
+        assert np.array_equal(np.sort(mask_started_within(df, *args)), np.sort(index.started_within(*nargs)))
+
+    validity = f"valid for {stop_after}" if stop_after is not None else "open-ended"
+    print(f"{rows} rows ({validity}), {queries} queries per predicate (mean microseconds per query)")
+    print(f"  valid at vt as of tt      mask: {timed(lambda *a: mask_valid_at(df, *a), point_args):10.1f}   index: {timed(index.valid_at, np_point_args):10.1f}")
+    print(f"  started in [vs, ve) as tt mask: {timed(lambda *a: mask_started_within(df, *a), range_args):10.1f}   index: {timed(index.started_within, np_range_args):10.1f}")
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    run(rows, queries)
+    # Open-ended measurements are valid at every later time, so "valid at" returns most of the slice;
+    # with validity periods only the rows around vt qualify.
+    run(rows, queries, stop_after=pd.Timedelta(hours=1))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Scaling benchmarks for loading, querying and appending.
+
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 1000000 10000000
+    python benchmarks/run_benchmarks.py --sizes 10000 --compare benchmarks/results/<earlier>.json
+
+For every size a synthetic dataset is generated and written to a temporary file, then
+loading (TemporalDataManager construction: _load_and_prepare_data plus the index build),
+point_in_time_query, point_in_time_batch, history_query and append_data_from_file are measured. Latencies are reported as percentiles, throughput as
+queries per second and peak memory via tracemalloc. Results are written to
+benchmarks/results/ as JSON so later runs can be compared against them.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic import generate_dataset, write_dataset
+from temporal_db.data_manager import LoincManager, TemporalDataManager
+from temporal_db.query_engine import TemporalQueryEngine
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def _percentiles(samples: list) -> dict:
+    ms = np.asarray(samples) * 1000
+    return {'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95)),
+            'p99_ms': float(np.percentile(ms, 99)), 'mean_ms': float(ms.mean()),
+            'throughput_qps': float(len(ms) / (ms.sum() / 1000)) if ms.sum() else None}
+
+def _measure(fn, *args, track_memory: bool = False, **kwargs):
+    """Runs fn once; returns (result, seconds, peak bytes or None)."""
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = None
+    if track_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+def _sample_queries(df: pd.DataFrame, count: int, rng) -> pd.DataFrame:
+    rows = df.iloc[rng.integers(0, len(df), count)]
+    offsets = pd.to_timedelta(rng.integers(0, 6 * 3600, count), unit='s')
+    return pd.DataFrame({
+        'first_name': rows['first_name'].astype(str).to_numpy(),
+        'last_name': rows['last_name'].astype(str).to_numpy(),
+        'loinc_code': rows['loinc_code'].astype(str).to_numpy(),
+        'valid_time': (rows['valid_start_time'] + offsets).dt.strftime('%Y-%m-%d %H:%M').to_numpy(),
+        'transaction_time': (rows['transaction_time'] + pd.Timedelta(days=1)).dt.strftime('%Y-%m-%d %H:%M').to_numpy(),
+    })
+
+def run_size(rows: int, queries: int, appends: int, file_format: str, workdir: str, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    source = os.path.join(workdir, f"synthetic_{rows}.{file_format}")
+    write_dataset(generate_dataset(rows, seed=seed), source)
+
+    loinc_manager = LoincManager(os.path.join(workdir, 'missing_loinc.csv'))
+    # Constructing the manager parses and prepares the file and builds the index
+    data_manager, load_seconds, load_peak = _measure(TemporalDataManager, source, loinc_manager, use_snapshot=False, track_memory=True)
+    _, index_seconds, _ = _measure(data_manager._build_index, data_manager.df)
+    engine = TemporalQueryEngine(data_manager, loinc_manager, cache_entries=0)
+
+    sample = _sample_queries(data_manager.df, queries, rng)
+    point_times, history_times = [], []
+    for q in sample.itertuples(index=False):
+        point_times.append(_measure(engine.point_in_time_query, q.first_name, q.last_name, q.loinc_code, q.valid_time, q.transaction_time)[1])
+        history_times.append(_measure(engine.history_query, q.first_name, q.last_name, q.loinc_code, transaction_time=q.transaction_time, as_handle=True)[1])
+    _, batch_seconds, batch_peak = _measure(engine.point_in_time_batch, sample, track_memory=True)
+
+    append_times = []
+    batch_rows = max(10, rows // 1000)
+    for i in range(appends):
+        path = os.path.join(workdir, f"append_{rows}_{i}.csv")
+        write_dataset(generate_dataset(batch_rows, seed=seed + i + 1), path)
+        result, seconds, _ = _measure(data_manager.append_data_from_file, path)
+        if result.get('success'):
+            append_times.append(seconds)
+
+    return {
+        'rows': rows,
+        'format': file_format,
+        'load': {'seconds': load_seconds, 'index_build_seconds': index_seconds, 'rows_per_second': rows / load_seconds, 'peak_memory_bytes': load_peak},
+        'table_memory_bytes': int(data_manager.memory_report().loc['total', 'bytes_after']),
+        'point_in_time_query': _percentiles(point_times),
+        'history_query': _percentiles(history_times),
+        'point_in_time_batch': {'queries': queries, 'seconds': batch_seconds, 'throughput_qps': queries / batch_seconds, 'peak_memory_bytes': batch_peak},
+        'append_data_from_file': dict(_percentiles(append_times), batch_rows=batch_rows) if append_times else None,
+    }
+
+def compare(current: list, baseline_path: str):
+    """Prints the ratio current/baseline for the main latency figures of matching sizes."""
+    with open(baseline_path) as f:
+        baseline = {entry['rows']: entry for entry in json.load(f)['results']}
+    metrics = [('load', 'seconds'), ('point_in_time_query', 'p50_ms'), ('point_in_time_query', 'p99_ms'),
+               ('history_query', 'p50_ms'), ('point_in_time_batch', 'seconds'), ('append_data_from_file', 'p50_ms')]
+    print(f"\nComparison against {baseline_path} (ratio > 1 means slower now)")
+    for entry in current:
+        old = baseline.get(entry['rows'])
+        if old is None:
+            continue
+        for section, key in metrics:
+            new_value, old_value = (entry.get(section) or {}).get(key), (old.get(section) or {}).get(key)
+            if new_value and old_value:
+                print(f"  {entry['rows']:>10} {section}.{key:<8} {old_value:10.3f} -> {new_value:10.3f}  x{new_value / old_value:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bi-temporal engine across dataset sizes.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--appends', type=int, default=5)
+    parser.add_argument('--format', choices=['csv', 'xlsx', 'parquet'], default='csv')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--compare', default=None, help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.sizes:
+            print(f"Benchmarking {rows} rows...")
+            entry = run_size(rows, args.queries, args.appends, args.format, workdir, args.seed)
+            results.append(entry)
+            print(f"  load {entry['load']['seconds']:.2f}s (peak {entry['load']['peak_memory_bytes'] / 2**20:.0f} MiB), "
+                  f"point p50/p99 {entry['point_in_time_query']['p50_ms']:.2f}/{entry['point_in_time_query']['p99_ms']:.2f} ms, "
+                  f"history p50 {entry['history_query']['p50_ms']:.2f} ms, "
+                  f"batch {entry['point_in_time_batch']['throughput_qps']:.0f} q/s")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'created': datetime.now().isoformat(), 'python': platform.python_version(),
+                   'pandas': pd.__version__, 'numpy': np.__version__, 'results': results}, f, indent=2)
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Synthetic bi-temporal datasets in the same schema as project_db_2025.xlsx.
+
+    python benchmarks/synthetic.py out.csv --rows 100000 --patients 500
+
+Each patient gets a stay with measurements of a handful of LOINC codes at a configurable
+density; a fraction of measurements is corrected later (same valid start time, new value,
+later transaction time), which is what exercises the bi-temporal logic.
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# (LOINC code, unit, typical value, spread) - the codes used in the sample data
+LOINC_CODES = [
+    ('11218-5', 'cells/ml', 5000, 800), ('12181-4', 'mg/dl', 9, 1.5), ('14743-9', 'none', 120, 25),
+    ('20252-3', 'gr/dl', 12, 2), ('2055-2', 'mg/dl', 1.0, 0.3), ('30313-1', 'gr/dl', 13, 2),
+    ('39106-0', 'degrees-celsious', 37, 0.8), ('76477-9', 'BPM', 80, 15), ('80266-0', 'mmHg', 120, 15),
+]
+FIRST_NAMES = ['Eyal', 'Eli', 'Yonathan', 'David', 'Hana', 'Sima', 'Mary', 'Jennifer', 'Christopher', 'Matthew',
+               'Noa', 'Tamar', 'Avi', 'Yael', 'Omer', 'Maya', 'Daniel', 'Sarah', 'Michael', 'Rachel']
+LAST_NAMES = ['Rothman', 'Call', 'Spoon', 'Mizrahi', 'Levi', 'Nice', 'Gonzalez', 'Lopez', 'Lewis', 'Jones',
+              'Cohen', 'Peretz', 'Biton', 'Friedman', 'Katz', 'Smith', 'Brown', 'Davis', 'Miller', 'Wilson']
+SOURCE_COLUMNS = ['First name', 'Last name', 'LOINC-NUM', 'Value', 'Unit', 'Valid start time', 'Transaction time']
+
+def generate_dataset(rows: int, patients: int = None, codes_per_patient: int = 4, measurements_per_day: float = 24.0,
+                     correction_rate: float = 0.05, start: str = '2018-01-01', seed: int = 0) -> pd.DataFrame:
+    """
+    Returns about `rows` raw rows (source column names) including corrections.
+    `measurements_per_day` is per (patient, code) and sets how dense each stay is.
+    """
+    rng = np.random.default_rng(seed)
+    base_rows = max(1, int(round(rows / (1 + correction_rate))))
+    patients = patients or max(1, base_rows // 200)
+
+    # Patient identities: unique combinations of first/last name plus a numeric suffix when needed
+    first = np.array(FIRST_NAMES, dtype=object)[np.arange(patients) % len(FIRST_NAMES)]
+    last = np.array(LAST_NAMES, dtype=object)[(np.arange(patients) // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    generation = np.arange(patients) // (len(FIRST_NAMES) * len(LAST_NAMES))
+    last = np.where(generation > 0, last + generation.astype(str), last)
+
+    patient = rng.integers(0, patients, base_rows)
+    code_choices = np.array([rng.choice(len(LOINC_CODES), size=min(codes_per_patient, len(LOINC_CODES)), replace=False)
+                             for _ in range(patients)])
+    code = code_choices[patient, rng.integers(0, code_choices.shape[1], base_rows)]
+
+    # Each patient's stay starts at a random point in the year; measurements follow at the given density
+    admitted = pd.Timestamp(start).value + rng.integers(0, 365 * 86400, patients).astype(np.int64) * 10**9
+    per_pair = np.bincount(patient * len(LOINC_CODES) + code, minlength=patients * len(LOINC_CODES))
+    stay_seconds = np.maximum(per_pair[patient * len(LOINC_CODES) + code] / measurements_per_day * 86400, 3600)
+    valid_start = admitted[patient] + (rng.random(base_rows) * stay_seconds).astype(np.int64) * 10**9
+    valid_start = (valid_start // (60 * 10**9)) * 60 * 10**9  # whole minutes, like the source data
+    transaction = valid_start + rng.integers(1, 48, base_rows).astype(np.int64) * 3600 * 10**9
+
+    units = np.array([c[1] for c in LOINC_CODES], dtype=object)
+    centers = np.array([c[2] for c in LOINC_CODES], dtype=float)
+    spreads = np.array([c[3] for c in LOINC_CODES], dtype=float)
+    values = np.round(rng.normal(centers[code], spreads[code]), 1)
+
+    df = pd.DataFrame({
+        'First name': first[patient], 'Last name': last[patient],
+        'LOINC-NUM': np.array([c[0] for c in LOINC_CODES], dtype=object)[code],
+        'Value': values, 'Unit': units[code],
+        'Valid start time': pd.to_datetime(valid_start), 'Transaction time': pd.to_datetime(transaction),
+    })
+
+    # Retroactive corrections: same measurement, new value, recorded days later
+    corrected = df.sample(n=rows - base_rows, replace=rows - base_rows > base_rows, random_state=seed) if rows > base_rows else df.iloc[:0]
+    corrected = corrected.assign(
+        Value=np.round(corrected['Value'] * rng.normal(1.0, 0.05, len(corrected)), 1),
+        **{'Transaction time': corrected['Transaction time'] + pd.to_timedelta(rng.integers(1, 10, len(corrected)), unit='D')})
+    return pd.concat([df, corrected], ignore_index=True)[SOURCE_COLUMNS]
+
+def write_dataset(df: pd.DataFrame, path: str):
+    """Writes a generated dataset as .xlsx, .csv or .parquet, chosen by extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.xlsx':
+        df.to_excel(path, index=False, engine='openpyxl')
+    elif extension == '.parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic bi-temporal dataset.")
+    parser.add_argument('path', help="Output file (.xlsx, .csv or .parquet)")
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--patients', type=int, default=None)
+    parser.add_argument('--codes-per-patient', type=int, default=4)
+    parser.add_argument('--measurements-per-day', type=float, default=24.0)
+    parser.add_argument('--correction-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    df = generate_dataset(args.rows, args.patients, args.codes_per_patient, args.measurements_per_day, args.correction_rate, seed=args.seed)
+    write_dataset(df, args.path)
+    print(f"Wrote {len(df)} rows to {args.path}")
+
+if __name__ == '__main__':
+    main()
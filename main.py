@@ -4,10 +4,18 @@ from tkcalendar import DateEntry
 from dateutil.parser import parse as date_parse
 from dateutil.parser._parser import ParserError
 from temporal_db.data_manager import TemporalDataManager, LoincManager
-from temporal_db.query_engine import TemporalQueryEngine
+from temporal_db.query_engine import TemporalQueryEngine, HistoryResult
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 import os
+import threading
+import time
 import pandas as pd
 
+# How often (ms) the Tk loop checks on background tasks.
+POLL_INTERVAL_MS = 50
+# History rows inserted into the results table per page; more are fetched while scrolling.
+HISTORY_PAGE_SIZE = 200
+
 class App(tk.Tk):
     def __init__(self, engine, data_manager):
         super().__init__()
@@ -15,6 +23,11 @@ class App(tk.Tk):
         self.data_manager = data_manager
         self.title("Bi-Temporal DBMS - 2025")
         self.geometry("950x650")
+        # Queries and appends run on worker threads; results are handed back to Tk via after().
+        # Threads rather than processes, since workers share the loaded data and index.
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bitemporal")
+        self.tasks = {}
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(pady=10, padx=10, fill="both", expand=True)
@@ -27,12 +40,14 @@ class App(tk.Tk):
 
         self.notebook.add(self.q1_frame, text="Query 1: Point-in-Time")
         self.notebook.add(self.q2_frame, text="Query 2: History")
-        self.notebook.add(self.q3_frame, text="Query 3 (Coming Soon)")
-        self.notebook.add(self.q4_frame, text="Query 4 (Coming Soon)")
+        self.notebook.add(self.q3_frame, text="Query 3: Cohort Latest")
+        self.notebook.add(self.q4_frame, text="Query 4: Cohort Statistics")
         self.notebook.add(self.add_data_frame, text="Add Data")
 
         self.setup_query1_tab()
         self.setup_query2_tab()
+        self.setup_query3_tab()
+        self.setup_query4_tab()
         self.setup_add_data_tab()
 
     def setup_query1_tab(self):
@@ -65,8 +80,12 @@ class App(tk.Tk):
         self.q1_trans_time = ttk.Entry(input_frame, width=10)
         self.q1_trans_time.grid(row=4, column=2, padx=5, pady=5, sticky="w")
         
-        run_button = ttk.Button(frame, text="Run Point-in-Time Query", command=self.run_query1)
-        run_button.pack(pady=10)
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(pady=10)
+        ttk.Button(button_frame, text="Run Point-in-Time Query", command=self.run_query1).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Cancel", command=lambda: self.cancel_task("query1", self.q1_status_label)).pack(side="left", padx=5)
+        self.q1_status_label = ttk.Label(button_frame, text="")
+        self.q1_status_label.pack(side="left", padx=5)
         for widget in input_frame.winfo_children():
             if isinstance(widget, (ttk.Entry, DateEntry)):
                 widget.bind("<Return>", self.run_query1)
@@ -121,8 +140,12 @@ class App(tk.Tk):
         self.q2_trans_time = ttk.Entry(input_frame, width=10)
         self.q2_trans_time.grid(row=5, column=2, padx=5, pady=5, sticky="w")
 
-        run_button = ttk.Button(frame, text="Run History Query", command=self.run_query2)
-        run_button.pack(pady=10)
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(pady=10)
+        ttk.Button(button_frame, text="Run History Query", command=self.run_query2).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Cancel", command=lambda: self.cancel_task("query2", self.q2_status_label)).pack(side="left", padx=5)
+        self.q2_status_label = ttk.Label(button_frame, text="")
+        self.q2_status_label.pack(side="left", padx=5)
         for widget in input_frame.winfo_children():
             if isinstance(widget, (ttk.Entry, DateEntry)):
                 widget.bind("<Return>", self.run_query2)
@@ -135,39 +158,211 @@ class App(tk.Tk):
         for col in cols:
             self.q2_result_tree.heading(col, text=col.replace('_', ' ').title())
             self.q2_result_tree.column(col, width=110)
+        self.q2_scrollbar = ttk.Scrollbar(result_frame, orient="vertical", command=self.q2_result_tree.yview)
+        self.q2_result_tree.configure(yscrollcommand=self.on_q2_scroll)
+        self.q2_scrollbar.pack(side="right", fill="y", pady=5)
         self.q2_result_tree.pack(fill="both", expand=True, padx=5, pady=5)
+        self.q2_result = None
+        self.q2_rows_shown = 0
+
+    def setup_query3_tab(self):
+        frame = self.q3_frame
+        input_frame = ttk.LabelFrame(frame, text="Query Parameters")
+        input_frame.pack(fill="x", padx=10, pady=10)
+
+        ttk.Label(input_frame, text="LOINC Code:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        self.q3_loinc = ttk.Entry(input_frame, width=30)
+        self.q3_loinc.grid(row=0, column=1, columnspan=2, padx=5, pady=5, sticky="w")
+
+        ttk.Label(input_frame, text="Valid Time:").grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        self.q3_valid_date = DateEntry(input_frame, width=12, date_pattern='y-mm-dd')
+        self.q3_valid_date.grid(row=1, column=1, padx=5, pady=5, sticky="w")
+        self.q3_valid_time = ttk.Entry(input_frame, width=10)
+        self.q3_valid_time.grid(row=1, column=2, padx=5, pady=5, sticky="w")
+        self.q3_valid_time.insert(0, "HH:MM")
+
+        ttk.Label(input_frame, text="Transaction Time (Optional):").grid(row=2, column=0, padx=5, pady=5, sticky="w")
+        self.q3_trans_date = DateEntry(input_frame, width=12, date_pattern='y-mm-dd')
+        self.q3_trans_date.grid(row=2, column=1, padx=5, pady=5, sticky="w")
+        self.q3_trans_date.set_date(None)
+        self.q3_trans_date.delete(0, tk.END)
+        self.q3_trans_time = ttk.Entry(input_frame, width=10)
+        self.q3_trans_time.grid(row=2, column=2, padx=5, pady=5, sticky="w")
+
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(pady=10)
+        ttk.Button(button_frame, text="Run Cohort Query", command=self.run_query3).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Cancel", command=lambda: self.cancel_task("query3", self.q3_status_label)).pack(side="left", padx=5)
+        self.q3_status_label = ttk.Label(button_frame, text="")
+        self.q3_status_label.pack(side="left", padx=5)
+        for widget in input_frame.winfo_children():
+            if isinstance(widget, (ttk.Entry, DateEntry)):
+                widget.bind("<Return>", self.run_query3)
+        result_frame = ttk.LabelFrame(frame, text="Query Result")
+        result_frame.pack(fill="both", expand=True, padx=10, pady=10)
+        self.q3_count_label = ttk.Label(result_frame, text="Patients found: 0")
+        self.q3_count_label.pack(anchor="w", padx=5)
+        cols = ('first_name', 'last_name', 'concept_name', 'value', 'unit', 'valid_start_time', 'transaction_time')
+        self.q3_result_tree = self._make_result_tree(result_frame, cols)
+
+    def setup_query4_tab(self):
+        frame = self.q4_frame
+        input_frame = ttk.LabelFrame(frame, text="Query Parameters")
+        input_frame.pack(fill="x", padx=10, pady=10)
+
+        ttk.Label(input_frame, text="LOINC Code:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        self.q4_loinc = ttk.Entry(input_frame, width=40)
+        self.q4_loinc.grid(row=0, column=1, columnspan=3, padx=5, pady=5, sticky="w")
+        ttk.Label(input_frame, text="or Concept Name:").grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        self.q4_concept = ttk.Entry(input_frame, width=40)
+        self.q4_concept.grid(row=1, column=1, columnspan=3, padx=5, pady=5, sticky="w")
+
+        ttk.Label(input_frame, text="Valid Time Range (Optional):").grid(row=2, column=0, padx=5, pady=5, sticky="w")
+        self.q4_valid_start_date = DateEntry(input_frame, width=12, date_pattern='y-mm-dd')
+        self.q4_valid_start_date.grid(row=2, column=1, padx=5, pady=5, sticky="w")
+        self.q4_valid_start_date.set_date(None)
+        self.q4_valid_start_date.delete(0, tk.END)
+        self.q4_valid_start_time = ttk.Entry(input_frame, width=10)
+        self.q4_valid_start_time.grid(row=2, column=2, padx=5, pady=5, sticky="w")
+
+        ttk.Label(input_frame, text="to").grid(row=2, column=3)
+        self.q4_valid_end_date = DateEntry(input_frame, width=12, date_pattern='y-mm-dd')
+        self.q4_valid_end_date.grid(row=2, column=4, padx=5, pady=5, sticky="w")
+        self.q4_valid_end_date.set_date(None)
+        self.q4_valid_end_date.delete(0, tk.END)
+        self.q4_valid_end_time = ttk.Entry(input_frame, width=10)
+        self.q4_valid_end_time.grid(row=2, column=5, padx=5, pady=5, sticky="w")
+
+        ttk.Label(input_frame, text="Point of View (Optional):").grid(row=3, column=0, padx=5, pady=5, sticky="w")
+        self.q4_trans_date = DateEntry(input_frame, width=12, date_pattern='y-mm-dd')
+        self.q4_trans_date.grid(row=3, column=1, padx=5, pady=5, sticky="w")
+        self.q4_trans_date.set_date(None)
+        self.q4_trans_date.delete(0, tk.END)
+        self.q4_trans_time = ttk.Entry(input_frame, width=10)
+        self.q4_trans_time.grid(row=3, column=2, padx=5, pady=5, sticky="w")
+
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(pady=10)
+        ttk.Button(button_frame, text="Run Statistics Query", command=self.run_query4).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Cancel", command=lambda: self.cancel_task("query4", self.q4_status_label)).pack(side="left", padx=5)
+        self.q4_status_label = ttk.Label(button_frame, text="")
+        self.q4_status_label.pack(side="left", padx=5)
+        for widget in input_frame.winfo_children():
+            if isinstance(widget, (ttk.Entry, DateEntry)):
+                widget.bind("<Return>", self.run_query4)
+        result_frame = ttk.LabelFrame(frame, text="Query Result")
+        result_frame.pack(fill="both", expand=True, padx=10, pady=10)
+        self.q4_summary_label = ttk.Label(result_frame, text="Patients found: 0")
+        self.q4_summary_label.pack(anchor="w", padx=5)
+        cols = ('first_name', 'last_name', 'count', 'non_numeric', 'min', 'max', 'mean', 'first_valid_start', 'last_valid_start')
+        self.q4_result_tree = self._make_result_tree(result_frame, cols)
+
+    def _make_result_tree(self, parent, cols):
+        tree = ttk.Treeview(parent, columns=cols, show="headings")
+        for col in cols:
+            tree.heading(col, text=col.replace('_', ' ').title())
+            tree.column(col, width=110)
+        scrollbar = ttk.Scrollbar(parent, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y", pady=5)
+        tree.pack(fill="both", expand=True, padx=5, pady=5)
+        return tree
 
     def setup_add_data_tab(self):
         frame = self.add_data_frame
         input_frame = ttk.LabelFrame(frame, text="Upload New Data File")
         input_frame.pack(fill="x", padx=10, pady=10)
         self.selected_file_path = tk.StringVar()
-        select_button = ttk.Button(input_frame, text="Select Excel File...", command=self.select_file)
+        select_button = ttk.Button(input_frame, text="Select Data File...", command=self.select_file)
         select_button.grid(row=0, column=0, padx=5, pady=10)
         file_label = ttk.Label(input_frame, textvariable=self.selected_file_path, wraplength=500)
         file_label.grid(row=0, column=1, padx=5, pady=10, sticky="w")
         append_button = ttk.Button(input_frame, text="Append Data to System", command=self.append_data)
-        append_button.grid(row=1, column=0, columnspan=2, padx=5, pady=10)
+        append_button.grid(row=1, column=0, padx=5, pady=10)
+        cancel_button = ttk.Button(input_frame, text="Cancel", command=lambda: self.cancel_task("append", self.add_data_status_label))
+        cancel_button.grid(row=1, column=1, padx=5, pady=10, sticky="w")
         status_frame = ttk.LabelFrame(frame, text="Status")
         status_frame.pack(fill="both", expand=True, padx=10, pady=10)
         self.add_data_status_label = ttk.Label(status_frame, text="Select a file to begin.")
         self.add_data_status_label.pack(padx=5, pady=5, anchor="w")
 
     def select_file(self):
-        file_path = filedialog.askopenfilename(title="Select an Excel file", filetypes=(("Excel files", "*.xlsx"), ("All files", "*.*")))
+        file_path = filedialog.askopenfilename(title="Select a data file", filetypes=(("Data files", "*.xlsx *.csv *.parquet"), ("Excel files", "*.xlsx"), ("CSV files", "*.csv"), ("Parquet files", "*.parquet"), ("All files", "*.*")))
         if file_path:
             self.selected_file_path.set(file_path)
             self.add_data_status_label.config(text=f"File selected: {os.path.basename(file_path)}")
 
+    def run_in_background(self, name, work, on_done, status_label, running_text, discard_on_cancel=True):
+        """
+        Runs work(cancel_event, progress) on the worker pool and passes its result to on_done on
+        the Tk thread. Starting a task under a name that is still running supersedes the old one.
+        Cancelling drops the result unless discard_on_cancel is False: then the task is only
+        asked to stop and its real outcome is still shown, for work that may already have
+        committed (an append cannot be undone once it reached the log).
+        """
+        self.cancel_task(name)
+        cancel_event = threading.Event()
+        progress = {"text": running_text}
+        future = self.executor.submit(work, cancel_event, lambda text: progress.update(text=text))
+        self.tasks[name] = (future, cancel_event, discard_on_cancel)
+        started = time.perf_counter()
+
+        def poll():
+            if self.tasks.get(name, (None,))[0] is not future:
+                return  # cancelled or superseded; drop the result
+            elapsed = time.perf_counter() - started
+            if not future.done():
+                status_label.config(text=f"{'Cancelling...' if cancel_event.is_set() else progress['text']} ({elapsed:.1f}s)")
+                self.after(POLL_INTERVAL_MS, poll)
+                return
+            del self.tasks[name]
+            status_label.config(text=f"Completed in {elapsed:.2f}s.")
+            try:
+                result = future.result()
+            except CancelledError:
+                result = {"error": "Cancelled."}
+            except Exception as e:
+                result = {"error": f"An unexpected error occurred: {e}"}
+            on_done(result)
+
+        status_label.config(text=running_text)
+        self.after(POLL_INTERVAL_MS, poll)
+
+    def cancel_task(self, name, status_label=None):
+        task = self.tasks.get(name)
+        if task is None:
+            return
+        future, cancel_event, discard_on_cancel = task
+        future.cancel()
+        cancel_event.set()
+        if discard_on_cancel:
+            del self.tasks[name]
+        if status_label is not None:
+            status_label.config(text="Cancelled." if discard_on_cancel else "Cancelling...")
+
+    def on_close(self):
+        for name in list(self.tasks):
+            self.cancel_task(name)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.data_manager.close()
+        self.destroy()
+
     def append_data(self):
         file_path = self.selected_file_path.get()
         if not file_path:
             self.add_data_status_label.config(text="Error: No file selected. Please select a file first.")
             return
-        result = self.data_manager.append_data_from_file(file_path)
+        if "append" in self.tasks:
+            self.add_data_status_label.config(text="An append is still running; wait for it to finish.")
+            return
+        self.run_in_background(
+            "append",
+            lambda cancel_event, progress: self.data_manager.append_data_from_file(file_path, progress=progress, cancel_event=cancel_event),
+            self.show_append_result, self.add_data_status_label, f"Loading {os.path.basename(file_path)}...", discard_on_cancel=False)
+
+    def show_append_result(self, result):
         if result.get("success"):
-            self.add_data_status_label.config(text=f"Success! Added {result['rows_added']} new records to the system.")
-            self.engine.df = self.data_manager.df
+            self.add_data_status_label.config(text=f"Success! Added {result['rows_added']} new records to the system in {result['elapsed_seconds']:.2f}s.")
         else:
             self.add_data_status_label.config(text=f"Failed to add data. Error: {result.get('error', 'Unknown error')}")
 
@@ -197,24 +392,28 @@ class App(tk.Tk):
             params = {"first_name": self.q1_first_name.get(), "last_name": self.q1_last_name.get(), "loinc_code": self.q1_loinc.get(), "valid_time": valid_datetime_str, "transaction_time": trans_datetime_str}
             if not all([params["first_name"], params["last_name"], params["loinc_code"], params["valid_time"]]):
                 raise ValueError("First Name, Last Name, LOINC, and Valid Time are required.")
-            result = self.engine.point_in_time_query(**params)
-            if 'error' in result: self.q1_result_tree.insert("", "end", values=("Error", result['error']))
-            else:
-                display_order = ['first_name', 'last_name', 'concept_name', 'loinc_code', 'value', 'unit', 'valid_start_time', 'valid_stop_time', 'transaction_time']
-                displayed_keys = set()
-                for key in display_order:
-                    if key in result:
-                        value = result[key]
-                        if isinstance(value, pd.Timestamp): value = value.strftime('%Y-%m-%d %H:%M:%S')
-                        self.q1_result_tree.insert("", "end", values=(key, value))
-                        displayed_keys.add(key)
-                for key, value in result.items():
-                    if key not in displayed_keys:
-                        if isinstance(value, pd.Timestamp): value = value.strftime('%Y-%m-%d %H:%M:%S')
-                        self.q1_result_tree.insert("", "end", values=(key, value))
+            self.run_in_background("query1", lambda cancel_event, progress: self.engine.point_in_time_query(**params, cancel_event=cancel_event),
+                                   self.show_query1_result, self.q1_status_label, "Running query...")
         except (ValueError, ParserError) as e:
             self.q1_result_tree.insert("", "end", values=("Input Error", str(e)))
 
+    def show_query1_result(self, result):
+        for i in self.q1_result_tree.get_children(): self.q1_result_tree.delete(i)
+        if 'error' in result: self.q1_result_tree.insert("", "end", values=("Error", result['error']))
+        else:
+            display_order = ['first_name', 'last_name', 'concept_name', 'loinc_code', 'value', 'unit', 'valid_start_time', 'valid_stop_time', 'transaction_time']
+            displayed_keys = set()
+            for key in display_order:
+                if key in result:
+                    value = result[key]
+                    if isinstance(value, pd.Timestamp): value = value.strftime('%Y-%m-%d %H:%M:%S')
+                    self.q1_result_tree.insert("", "end", values=(key, value))
+                    displayed_keys.add(key)
+            for key, value in result.items():
+                if key not in displayed_keys:
+                    if isinstance(value, pd.Timestamp): value = value.strftime('%Y-%m-%d %H:%M:%S')
+                    self.q1_result_tree.insert("", "end", values=(key, value))
+
     def run_query2(self, event=None):
         for i in self.q2_result_tree.get_children(): self.q2_result_tree.delete(i)
         self.q2_count_label.config(text="Records found: 0")
@@ -228,19 +427,105 @@ class App(tk.Tk):
             params = {"first_name": self.q2_first_name.get(), "last_name": self.q2_last_name.get(), "loinc_code": self.q2_loinc.get() or None, "concept_name": self.q2_concept.get() or None, "valid_start": valid_start, "valid_end": valid_end, "transaction_time": transaction_time}
             if not all([params["first_name"], params["last_name"]]):
                 raise ValueError("First Name and Last Name are required.")
-            result = self.engine.history_query(**params)
-            self.q2_count_label.config(text=f"Records found: {result.get('count', 0)}")
-            if 'error' in result:
-                self.q2_result_tree.insert("", "end", values=(result['error'], "", "", "", "", "", "", ""))
-            elif 'data' in result:
-                for record in result['data']:
-                    row = [record.get(col, '') for col in self.q2_result_tree['columns']]
-                    for i, val in enumerate(row):
-                        if isinstance(val, pd.Timestamp): row[i] = val.strftime('%Y-%m-%d %H:%M:%S')
-                    self.q2_result_tree.insert("", "end", values=row)
+            self.run_in_background("query2", lambda cancel_event, progress: self.engine.history_query(**params, as_handle=True, cancel_event=cancel_event),
+                                   self.show_query2_result, self.q2_status_label, "Running query...")
         except (ValueError, ParserError) as e:
             self.q2_result_tree.insert("", "end", values=(str(e), "", "", "", "", "", "", ""))
 
+    def show_query2_result(self, result):
+        for i in self.q2_result_tree.get_children(): self.q2_result_tree.delete(i)
+        self.q2_result, self.q2_rows_shown = None, 0
+        self.q2_count_label.config(text=f"Records found: {result.get('count', 0)}")
+        if 'error' in result:
+            self.q2_result_tree.insert("", "end", values=(result['error'], "", "", "", "", "", "", ""))
+        elif 'data' in result:
+            self.q2_result = result['data'] if isinstance(result['data'], HistoryResult) else HistoryResult(pd.DataFrame(result['data']))
+            self.load_next_q2_page()
+
+    def load_next_q2_page(self):
+        """Inserts the next page of history rows; only the rows being shown are formatted."""
+        if self.q2_result is None or self.q2_rows_shown >= len(self.q2_result):
+            return
+        columns = self.q2_result_tree['columns']
+        available = [col for col in columns if col in self.q2_result.frame.columns]
+        stop = self.q2_rows_shown + HISTORY_PAGE_SIZE
+        for record in self.q2_result.page(self.q2_rows_shown, stop, available):
+            row = [record.get(col, '') for col in columns]
+            for i, val in enumerate(row):
+                if isinstance(val, pd.Timestamp): row[i] = val.strftime('%Y-%m-%d %H:%M:%S')
+            self.q2_result_tree.insert("", "end", values=row)
+        self.q2_rows_shown = min(stop, len(self.q2_result))
+        self.q2_count_label.config(text=f"Records found: {len(self.q2_result)} (showing {self.q2_rows_shown})")
+
+    def on_q2_scroll(self, first, last):
+        self.q2_scrollbar.set(first, last)
+        # Fetch the next page once the user scrolls near the end of what is loaded.
+        if float(last) > 0.9:
+            self.after_idle(self.load_next_q2_page)
+
+    def _fill_result_tree(self, tree, records):
+        for i in tree.get_children(): tree.delete(i)
+        columns = tree['columns']
+        for record in records:
+            row = [record.get(col, '') for col in columns]
+            for i, val in enumerate(row):
+                if isinstance(val, pd.Timestamp): row[i] = val.strftime('%Y-%m-%d %H:%M:%S')
+                elif isinstance(val, float): row[i] = '' if pd.isna(val) else f"{val:.2f}"
+            tree.insert("", "end", values=row)
+
+    def run_query3(self, event=None):
+        for i in self.q3_result_tree.get_children(): self.q3_result_tree.delete(i)
+        self.q3_count_label.config(text="Patients found: 0")
+        try:
+            valid_time = self._parse_datetime(self.q3_valid_date, self.q3_valid_time)
+            if valid_time == "invalid_date": raise ValueError("Invalid format for Valid Time.")
+            transaction_time = self._parse_datetime(self.q3_trans_date, self.q3_trans_time)
+            if transaction_time == "invalid_date": raise ValueError("Invalid format for Transaction Time.")
+            params = {"loinc_code": self.q3_loinc.get(), "valid_time": valid_time, "transaction_time": transaction_time}
+            if not all([params["loinc_code"], params["valid_time"]]):
+                raise ValueError("LOINC and Valid Time are required.")
+            self.run_in_background("query3", lambda cancel_event, progress: self.engine.cohort_latest_query(**params, cancel_event=cancel_event),
+                                   self.show_query3_result, self.q3_status_label, "Running query...")
+        except (ValueError, ParserError) as e:
+            self.q3_count_label.config(text=f"Input Error: {e}")
+
+    def show_query3_result(self, result):
+        if 'error' in result:
+            self._fill_result_tree(self.q3_result_tree, [])
+            self.q3_count_label.config(text=f"Error: {result['error']}")
+            return
+        self._fill_result_tree(self.q3_result_tree, result['data'])
+        self.q3_count_label.config(text=f"Patients found: {result['count']}")
+
+    def run_query4(self, event=None):
+        for i in self.q4_result_tree.get_children(): self.q4_result_tree.delete(i)
+        self.q4_summary_label.config(text="Patients found: 0")
+        try:
+            valid_start = self._parse_datetime(self.q4_valid_start_date, self.q4_valid_start_time)
+            if valid_start == "invalid_date": raise ValueError("Invalid format for Valid Start Time.")
+            valid_end = self._parse_datetime(self.q4_valid_end_date, self.q4_valid_end_time)
+            if valid_end == "invalid_date": raise ValueError("Invalid format for Valid End Time.")
+            transaction_time = self._parse_datetime(self.q4_trans_date, self.q4_trans_time)
+            if transaction_time == "invalid_date": raise ValueError("Invalid format for Point of View Time.")
+            params = {"loinc_code": self.q4_loinc.get() or None, "concept_name": self.q4_concept.get() or None, "valid_start": valid_start, "valid_end": valid_end, "transaction_time": transaction_time}
+            if not (params["loinc_code"] or params["concept_name"]):
+                raise ValueError("A LOINC Code or a Concept Name is required.")
+            self.run_in_background("query4", lambda cancel_event, progress: self.engine.cohort_aggregate_query(**params, cancel_event=cancel_event),
+                                   self.show_query4_result, self.q4_status_label, "Running query...")
+        except (ValueError, ParserError) as e:
+            self.q4_summary_label.config(text=f"Input Error: {e}")
+
+    def show_query4_result(self, result):
+        if 'error' in result:
+            self._fill_result_tree(self.q4_result_tree, [])
+            self.q4_summary_label.config(text=f"Error: {result['error']}")
+            return
+        self._fill_result_tree(self.q4_result_tree, result['data'])
+        summary = result['summary']
+        stats = "" if pd.isna(summary['mean']) else f", min {summary['min']:.2f}, max {summary['max']:.2f}, mean {summary['mean']:.2f}"
+        skipped = f" ({summary['non_numeric']} non-numeric skipped)" if summary['non_numeric'] else ""
+        self.q4_summary_label.config(text=f"Patients found: {summary['patients']}, measurements: {summary['measurements']}{skipped}{stats}")
+
 def main():
     print("Initializing Bi-Temporal DBMS...")
     project_root = os.path.dirname(os.path.abspath(__file__))
@@ -255,7 +540,7 @@ def main():
         root.mainloop()
         return
     try:
-        loinc_manager = LoincManager(file_path=loinc_file)
+        loinc_manager = LoincManager.shared(loinc_file)
         data_manager = TemporalDataManager(file_path=data_file, loinc_manager=loinc_manager)
     except Exception as e:
         root = tk.Tk()
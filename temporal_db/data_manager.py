@@ -1,96 +1,639 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
+import time
 from datetime import datetime
+from pandas.api.types import union_categoricals
+from .profiling import NULL_TRACE, Profiler
+from .loinc_lookup import LoincLookup, default_lookup_dir, read_loinc_csv
+from .snapshot import default_snapshot_dir, load_snapshot, load_snapshot_rows, save_snapshot, source_signature
+from .temporal_index import TemporalIndex
+from .transaction_log import TransactionLog, default_log_dir
+
+_EMPTY_POSITIONS = np.empty(0, dtype=np.int64)
+
+# Rows parsed and normalized at a time when streaming a source file.
+CHUNK_ROWS = 50_000
+# Repetitive string columns stored dictionary-encoded to keep the table compact.
+CATEGORICAL_COLUMNS = ['first_name', 'last_name', 'loinc_code', 'concept_name', 'unit']
+# Logged append batches after which the appended rows are compacted into a snapshot.
+COMPACT_EVERY = 32
+# Folder inside the log directory that holds the compacted appended rows.
+COMPACTED_DIR = 'compacted'
+# concept_name of codes that are not in the LOINC table.
+UNKNOWN_CONCEPT = 'Unknown Concept'
+
+def _patient_key(first_name, last_name) -> tuple:
+    """Normalized (first, last) key used by the patient/LOINC index."""
+    return (str(first_name).strip().lower(), str(last_name).strip().lower())
+
+def _map_categories(series: pd.Series, func) -> pd.Series:
+    """
+    Applies func (a vectorized Series -> Series transform) once per distinct value of series
+    and returns the result as a categorical aligned with series, so the cost of string work
+    scales with the number of distinct values instead of the number of rows.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    mapped_codes, mapped_uniques = pd.factorize(func(pd.Series(np.asarray(uniques, dtype=object))))
+    # A value mapped to NaN becomes code -1, i.e. a missing entry of the categorical.
+    row_codes = np.append(mapped_codes, -1)[codes]
+    return pd.Series(pd.Categorical.from_codes(row_codes, categories=mapped_uniques), index=series.index)
+
+def _normalize_loinc(codes: pd.Series) -> pd.Series:
+    return codes.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+
+def _normalize_name(names: pd.Series) -> pd.Series:
+    return names.astype(str).str.strip().str.lower()
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Bytes per column of df as stored, next to what the same column costs as plain Python
+    objects (the representation the loader used before categoricals were introduced).
+    """
+    rows = []
+    for col in df.columns:
+        series = df[col]
+        after = series.memory_usage(index=False, deep=True)
+        before = series.astype(object).memory_usage(index=False, deep=True) if isinstance(series.dtype, pd.CategoricalDtype) else after
+        rows.append({'column': col, 'dtype': str(series.dtype), 'bytes_before': before, 'bytes_after': after})
+    report = pd.DataFrame(rows, columns=['column', 'dtype', 'bytes_before', 'bytes_after']).set_index('column')
+    report.loc['total'] = ['', report['bytes_before'].sum(), report['bytes_after'].sum()]
+    return report
+
+def _concat_frames(frames: list) -> pd.DataFrame:
+    """
+    Concatenates prepared frames, unioning categorical columns so they stay categorical
+    (a plain pd.concat falls back to object dtype when the categories differ).
+    """
+    frames = [frame for frame in frames if len(frame.columns)]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    data = {}
+    for col in dict.fromkeys(col for frame in frames for col in frame.columns):
+        parts = [frame[col] if col in frame.columns else pd.Series(np.nan, index=frame.index) for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            try:
+                data[col] = pd.Series(union_categoricals(parts, ignore_order=True))
+                continue
+            except TypeError:
+                pass
+            try:
+                # Categories of different dtypes (e.g. str from a snapshot vs. object); retry as object.
+                as_object = [pd.Categorical.from_codes(part.cat.codes, categories=pd.Index(part.cat.categories, dtype=object)) for part in parts]
+                data[col] = pd.Series(union_categoricals(as_object, ignore_order=True))
+                continue
+            except TypeError:
+                # Categories of different types (e.g. numbers vs. strings); fall through to object.
+                parts = [part.astype(object) for part in parts]
+        data[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(data)
+
+def _iter_raw_chunks(file_path: str, chunk_rows: int):
+    """
+    Streams a source file as DataFrames of at most chunk_rows raw rows, so large files
+    are never materialized as one object-dtype frame. Excel is read with openpyxl in
+    read-only mode; CSV and Parquet (requires pyarrow) are supported as faster formats.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        yield from pd.read_csv(file_path, chunksize=chunk_rows, usecols=lambda col: not str(col).startswith('Unnamed:'),
+                               dtype={'LOINC-NUM': str, 'loinc-num': str})
+    elif extension == '.parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        import openpyxl
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, ())
+            keep = [i for i, col in enumerate(header) if col is not None and not str(col).startswith('Unnamed:')]
+            columns = [str(header[i]) for i in keep]
+            buffer = []
+            for row in rows:
+                values = [row[i] if i < len(row) else None for i in keep]
+                if all(value is None for value in values):
+                    continue
+                buffer.append(values)
+                if len(buffer) >= chunk_rows:
+                    yield pd.DataFrame(buffer, columns=columns, dtype=object)
+                    buffer = []
+            if buffer or not columns:
+                yield pd.DataFrame(buffer, columns=columns, dtype=object)
+        finally:
+            workbook.close()
+
+def _prepare_chunk(df: pd.DataFrame, loinc_manager) -> pd.DataFrame:
+    """
+    Standardizes column names, validates required columns, enriches with LOINC names from loinc_manager,
+    parses the time columns and converts repetitive strings to categoricals.
+    """
+    df.columns = [str(col).strip().lower().replace(' ', '_').replace('-', '_') for col in df.columns]
+
+    if 'loinc_num' in df.columns:
+        df.rename(columns={'loinc_num': 'loinc_code'}, inplace=True)
+
+    if 'loinc_code' in df.columns:
+        # Normalization and name enrichment run once per distinct code, not per row
+        df['loinc_code'] = _map_categories(df['loinc_code'], _normalize_loinc)
+        df['concept_name'] = _map_categories(df['loinc_code'], lambda codes: loinc_manager.names_for(codes).fillna(UNKNOWN_CONCEPT))
+    else:
+        # This is a critical failure for a file to be valid
+        raise ValueError("'loinc_num' or 'loinc_code' column not found in the file.")
+
+    if 'valid_stop_time' not in df.columns:
+        df['valid_stop_time'] = pd.NaT
+
+    time_cols = ['valid_start_time', 'transaction_time']
+    for col in time_cols:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce').astype('datetime64[ns]')
+        else:
+            raise ValueError(f"Required time column '{col}' not found in the file.")
+
+    df['valid_stop_time'] = pd.to_datetime(df['valid_stop_time'], errors='coerce').astype('datetime64[ns]')
+
+    end_of_time = pd.Timestamp.max
+    df['valid_stop_time'] = df['valid_stop_time'].fillna(end_of_time)
+
+    # Rows streamed from Excel arrive as Python objects; numeric values get a numeric dtype like read_excel gave them
+    if 'value' in df.columns and df['value'].dtype == object:
+        numeric = pd.to_numeric(df['value'], errors='coerce')
+        if numeric.notna().sum() == df['value'].notna().sum():
+            df['value'] = numeric
+
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+
+    return df
+
+def _parse_file(file_path: str, loinc_manager, chunk_rows: int = CHUNK_ROWS, progress=None, cancel_event=None) -> pd.DataFrame:
+    """
+    Streams file_path chunk by chunk through _prepare_chunk and returns the compacted result.
+    Errors propagate to the caller. `progress` is called with a status message after every
+    chunk; setting `cancel_event` aborts between chunks.
+    """
+    chunks, rows = [], 0
+    for chunk in _iter_raw_chunks(file_path, chunk_rows):
+        if cancel_event is not None and cancel_event.is_set():
+            raise InterruptedError("Loading was cancelled.")
+        chunks.append(_prepare_chunk(chunk, loinc_manager))
+        rows += len(chunk)
+        if progress is not None:
+            progress(f"Parsed {rows} rows from {os.path.basename(file_path)}...")
+    return _concat_frames(chunks)
+
+# LOINC manager of a bulk-load worker process, set once per process by _init_bulk_worker.
+_worker_loinc_manager = None
+
+def _init_bulk_worker(loinc_path: str, lookup_dir: str, use_lookup_cache: bool):
+    global _worker_loinc_manager
+    # Workers memory-map the compiled lookup instead of receiving a pickled copy of the table.
+    _worker_loinc_manager = LoincManager(loinc_path, lookup_dir, use_lookup_cache)
+
+def _parse_file_in_worker(file_path: str, chunk_rows: int) -> pd.DataFrame:
+    """Runs in a worker process; the prepared (categorical, datetime64) frame is pickled back."""
+    return _parse_file(file_path, _worker_loinc_manager, chunk_rows)
 
 class LoincManager:
-    """Manages LOINC codes and their descriptions."""
-    def __init__(self, file_path: str):
+    """
+    Manages LOINC codes and their descriptions.
+    The CSV is compiled once into a memory-mapped lookup (see loinc_lookup.py) that is
+    reused until the CSV changes, and nothing is read until a name is first needed.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, file_path: str, lookup_dir: str = None, use_lookup_cache: bool = True):
         self.file_path = file_path
-        self.loinc_map = self._load_loinc_codes()
+        self.lookup_dir = lookup_dir or default_lookup_dir(file_path)
+        self.use_lookup_cache = use_lookup_cache
+        self._lookup = None
+        self._loinc_map = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, file_path: str) -> 'LoincManager':
+        """One manager per LOINC file for the whole process, so the table is loaded only once."""
+        key = os.path.abspath(file_path)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(file_path)
+            return cls._shared[key]
+
+    @property
+    def lookup(self) -> LoincLookup:
+        if self._lookup is None:
+            with self._lock:
+                if self._lookup is None:
+                    self._lookup = self._load_lookup()
+        return self._lookup
 
-    def _load_loinc_codes(self) -> dict:
+    @property
+    def loinc_map(self) -> dict:
+        """Plain code -> name dict, built on first access for callers that need one."""
+        if self._loinc_map is None:
+            self._loinc_map = self.lookup.to_dict()
+        return self._loinc_map
+
+    def _load_lookup(self) -> LoincLookup:
+        signature = source_signature(self.file_path)
+        if self.use_lookup_cache and signature[0][1] is not None:
+            lookup = LoincLookup.load(self.lookup_dir, signature)
+            if lookup is not None:
+                return lookup
         try:
-            df = pd.read_csv(self.file_path, header=None, names=['loinc_num', 'long_common_name'], usecols=[0, 1], dtype={'loinc_num': str})
-            df['loinc_num'] = df['loinc_num'].str.strip()
-            return pd.Series(df.long_common_name.values, index=df.loinc_num).to_dict()
+            lookup = LoincLookup.from_frame(read_loinc_csv(self.file_path))
         except FileNotFoundError:
             print(f"Error: LOINC file not found at {self.file_path}")
-            return {}
-        except (KeyError, AttributeError, IndexError):
+            return LoincLookup.empty()
+        except (KeyError, AttributeError, IndexError, ValueError):
             print(f"Error: Could not parse 'loinc_num' or 'long_common_name' from {self.file_path}.")
-            return {}
+            return LoincLookup.empty()
+        if self.use_lookup_cache:
+            try:
+                lookup.save(self.lookup_dir, signature)
+            except OSError as e:
+                print(f"Warning: could not write LOINC lookup to {self.lookup_dir}: {e}")
+        return lookup
 
     def get_long_name(self, loinc_code: str) -> str:
-        return self.loinc_map.get(str(loinc_code).strip(), "Unknown LOINC Code")
+        return self.lookup.get(loinc_code, "Unknown LOINC Code")
+
+    def names_for(self, codes: pd.Series) -> pd.Series:
+        """Vectorized code -> long name (NaN for unknown codes)."""
+        return self.lookup.names_for(codes)
+
+    def codes_for_name(self, concept_name: str, candidates=None) -> list:
+        """
+        LOINC codes whose concept name (as stored in the data) equals concept_name, ignoring
+        case. Codes missing from the table are stored as UNKNOWN_CONCEPT, so that name can
+        only be resolved against `candidates`, the codes actually present.
+        """
+        if concept_name.lower() == UNKNOWN_CONCEPT.lower():
+            return [code for code in (candidates if candidates is not None else ()) if code not in self.lookup]
+        codes = self.lookup.codes_for_name(concept_name)
+        if candidates is None:
+            return codes
+        candidates = set(candidates)
+        return [code for code in codes if code in candidates]
 
 class TemporalDataManager:
     """Manages loading, preprocessing, and enriching of the bi-temporal medical data."""
-    def __init__(self, file_path: str, loinc_manager: LoincManager):
+    def __init__(self, file_path: str, loinc_manager: LoincManager, snapshot_dir: str = None, use_snapshot: bool = True,
+                 log_dir: str = None, use_log: bool = True, compact_every: int = COMPACT_EVERY, profiler: Profiler = None):
         self.file_path = file_path
         self.loinc_manager = loinc_manager
-        self.df = self._load_and_prepare_data(self.file_path)
+        # Serializes appends. Queries read without it: rows are only ever added at the end, and
+        # df is replaced before the index entries that point at the new rows are published.
+        self.lock = threading.RLock()
+        self.use_snapshot = use_snapshot
+        self.snapshot_dir = snapshot_dir or default_snapshot_dir(file_path)
+        # Appended batches are logged before they become visible and replayed on the next start;
+        # every compact_every batches the appended rows are compacted into a snapshot kept with the log.
+        self.log = TransactionLog(log_dir or default_log_dir(file_path)) if use_log else None
+        self.compacted_dir = os.path.join(self.log.log_dir, COMPACTED_DIR) if use_log else None
+        self.compact_every = compact_every
+        # Opt-in instrumentation, shared with the query engines built on this manager.
+        self.profiler = profiler or Profiler()
+        trace = self.profiler.trace('load')
+        self.df = self._load_base_data(self.file_path, trace)
+        with trace.stage('log_replay'):
+            self._replay_log()
+        trace.rows(len(self.df))
+        with trace.stage('build_index'):
+            self.index = self._build_index(self.df)
+        trace.attach(None)
+        # Bumped by every successful append; caches compare against it to detect stale results.
+        self.version = 0
+        self._append_history = []
+        self.latest_transaction_time = self._max_transaction_time(self.df)
 
-    def _load_and_prepare_data(self, file_path) -> pd.DataFrame:
+    def _load_base_data(self, file_path, trace=NULL_TRACE) -> pd.DataFrame:
+        """
+        Loads the base data file, reusing the columnar snapshot when it was built from the same
+        data and LOINC files. Falls back to parsing the source (and refreshes the snapshot) otherwise.
+        """
+        signature = source_signature(file_path, self.loinc_manager.file_path)
+        if self.use_snapshot:
+            with trace.stage('snapshot_load'):
+                df = load_snapshot(self.snapshot_dir, signature)
+            if df is not None:
+                trace.rows(len(df))
+                print(f"Loaded {len(df)} records from snapshot: {self.snapshot_dir}")
+                return df
+
+        with trace.stage('parse'):
+            df = self._load_and_prepare_data(file_path)
+        trace.rows(len(df))
+        if self.use_snapshot and not df.empty:
+            try:
+                with trace.stage('snapshot_save'):
+                    save_snapshot(df, self.snapshot_dir, signature)
+            except OSError as e:
+                print(f"Warning: could not write snapshot to {self.snapshot_dir}: {e}")
+        return df
+
+    def _refresh_concept_names(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Re-derives concept_name from the current LOINC table for rows prepared in an earlier run."""
+        if 'loinc_code' in df.columns:
+            df['concept_name'] = _map_categories(df['loinc_code'], lambda codes: self.loinc_manager.names_for(codes).fillna(UNKNOWN_CONCEPT))
+        return df
+
+    def _replay_log(self):
+        """Appends the rows compacted by compact_log, then the logged batches newer than them."""
+        self._base_rows, self._compacted_sequence = len(self.df), 0
+        if self.log is None:
+            return
+        frames = []
+        meta, compacted = load_snapshot_rows(self.compacted_dir)
+        if compacted is not None:
+            frames.append(self._refresh_concept_names(compacted))
+            self._compacted_sequence = meta['log_sequence']
+            print(f"Loaded {len(compacted)} compacted records from {self.compacted_dir}")
+        elif os.path.exists(self.compacted_dir):
+            if self.log.read_only:
+                print(f"Warning: the compacted records in {self.compacted_dir} could not be read.")
+            else:
+                self._set_aside_compacted()
+        batches = self.log.replay(after_sequence=self._compacted_sequence)
+        frames += [self._refresh_concept_names(batch) for batch in batches]
+        if frames:
+            self.df = _concat_frames([self.df] + frames)
+        if batches:
+            print(f"Replayed {len(batches)} logged batches ({sum(len(b) for b in batches)} records) from {self.log.log_dir}")
+
+    def _set_aside_compacted(self):
+        """
+        Moves an unreadable compacted snapshot out of the way instead of letting the next
+        compaction overwrite it: its segments are already gone, so it holds the only copy of
+        the records it covers.
+        """
+        aside, n = self.compacted_dir + '.corrupt', 1
+        while os.path.exists(aside):
+            aside, n = f"{self.compacted_dir}.corrupt{n}", n + 1
+        os.replace(self.compacted_dir, aside)
+        print(f"Error: the compacted records in {self.compacted_dir} could not be read and were moved to {aside}. "
+              f"The records compacted into it are missing until it is restored.")
+
+    def compact_log(self):
+        """
+        Writes every appended row (everything after the base rows) as the compacted snapshot
+        next to the log and deletes the log segments it covers, so startup only replays the
+        batches appended since. The snapshot is swapped in before any segment is removed.
+        """
+        if self.log is None or self.log.read_only:
+            return
+        with self.lock:
+            sequence = self.log.last_sequence
+            if sequence == self._compacted_sequence:
+                return
+            save_snapshot(self.df.iloc[self._base_rows:], self.compacted_dir, [], log_sequence=sequence)
+            self._compacted_sequence = sequence
+            self.log.discard_through(sequence)
+            print(f"Compacted the transaction log through batch {sequence} into {self.compacted_dir}")
+
+    def close(self):
+        """Releases the transaction log, so another process can open it for appends."""
+        if self.log is not None:
+            self.log.close()
+
+    def _load_and_prepare_data(self, file_path, chunk_rows: int = CHUNK_ROWS, progress=None, cancel_event=None) -> pd.DataFrame:
         """
         Loads data from a specific file path, standardizes it, and enriches it.
+        The file is streamed in chunks that are prepared and compacted one at a time,
+        so peak memory stays close to the size of the compacted result.
+        `progress` is called with a status message after every chunk; setting `cancel_event`
+        aborts the load between chunks.
         """
         try:
-            header_df = pd.read_excel(file_path, nrows=0, engine='openpyxl')
-            valid_columns = [col for col in header_df.columns if not str(col).startswith('Unnamed:')]
-            df = pd.read_excel(file_path, engine='openpyxl', usecols=valid_columns, dtype={'LOINC-NUM': str, 'loinc-num': str})
+            return _parse_file(file_path, self.loinc_manager, chunk_rows, progress, cancel_event)
         except (FileNotFoundError, ImportError) as e:
             print(f"Error during file loading: {e}")
             return pd.DataFrame()
 
-        df.columns = [col.strip().lower().replace(' ', '_').replace('-', '_') for col in df.columns]
+    @staticmethod
+    def _max_transaction_time(df: pd.DataFrame):
+        latest = df['transaction_time'].max() if 'transaction_time' in df.columns else pd.NaT
+        return None if pd.isna(latest) else latest
 
-        if 'loinc_num' in df.columns:
-            df.rename(columns={'loinc_num': 'loinc_code'}, inplace=True)
-        
-        if 'loinc_code' in df.columns:
-            df['loinc_code'] = df['loinc_code'].astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
-            df['concept_name'] = df['loinc_code'].map(self.loinc_manager.loinc_map)
-            df['concept_name'] = df['concept_name'].fillna('Unknown Concept')
+    def earliest_transaction_since(self, version: int):
+        """
+        Earliest transaction time among the batches appended after `version`, or None if
+        nothing visible was appended since. Results for transaction times strictly before
+        it are unaffected by those appends.
+        """
+        times = [earliest for v, earliest in self._append_history if v > version and earliest is not None]
+        return min(times) if times else None
+
+    def all_known_at(self, tt) -> bool:
+        """True if every stored record had been recorded by transaction time tt."""
+        return self.latest_transaction_time is None or self.latest_transaction_time <= tt
+
+    def memory_report(self) -> pd.DataFrame:
+        """Per-column memory of the loaded table, compact representation vs. plain objects."""
+        return memory_report(self.df)
+
+    def _build_index(self, df: pd.DataFrame, offset: int = 0) -> dict:
+        """
+        Builds the lookup index: patient key -> LOINC code -> TemporalIndex over that pair's
+        rows, so queries need a hash lookup plus binary searches instead of scanning the
+        whole table. `offset` shifts the positions when df is a batch that will sit at the
+        end of the main table.
+        """
+        index = {}
+        if df.empty:
+            return index
+        # Names are lowercased per distinct value and rows are grouped on the integer codes.
+        first = _map_categories(df['first_name'], _normalize_name).cat
+        last = _map_categories(df['last_name'], _normalize_name).cat
+        loinc = df['loinc_code'].astype('category').cat
+        keys = pd.DataFrame({'first': first.codes, 'last': last.codes, 'loinc': loinc.codes})
+        start = df['valid_start_time'].to_numpy('datetime64[ns]')
+        stop = df['valid_stop_time'].to_numpy('datetime64[ns]')
+        tx = df['transaction_time'].to_numpy('datetime64[ns]')
+        for (f, l, c), rows in keys.groupby(['first', 'last', 'loinc'], sort=False).indices.items():
+            if f < 0 or l < 0 or c < 0:
+                continue
+            patient = (first.categories[f], last.categories[l])
+            index.setdefault(patient, {})[loinc.categories[c]] = TemporalIndex(rows + offset, start[rows], stop[rows], tx[rows])
+        return index
+
+    def _merge_into_index(self, batch_index: dict):
+        """
+        Merges the index of a freshly appended batch into the main index. Only the
+        (patient, LOINC) entries present in the batch are touched, so the current-state view
+        is only rebuilt for those entries.
+        """
+        for patient, by_code in batch_index.items():
+            existing = self.index.setdefault(patient, {})
+            for loinc, entry in by_code.items():
+                current = existing.get(loinc)
+                existing[loinc] = entry if current is None else current.merged(entry)
+
+    def lookup_entries(self, first_name: str, last_name: str, loinc_code=None, current: bool = False) -> list:
+        """
+        Returns the TemporalIndex entries of a patient, optionally restricted to one LOINC code
+        or to a list of codes. With current=True the entries of the current-state view are
+        returned instead, holding only the latest-known version of each measurement.
+        """
+        by_code = self.index.get(_patient_key(first_name, last_name), {})
+        if loinc_code is None:
+            entries = list(by_code.values())
         else:
-            # This is a critical failure for a file to be valid
-            raise ValueError("'loinc_num' or 'loinc_code' column not found in the file.")
+            codes = [loinc_code] if isinstance(loinc_code, str) else loinc_code
+            entries = [by_code[code] for code in (str(c).strip() for c in codes) if code in by_code]
+        return [entry.current_state() for entry in entries] if current else entries
 
-        if 'valid_stop_time' not in df.columns:
-            df['valid_stop_time'] = pd.NaT
+    def patient_codes(self, first_name: str, last_name: str) -> list:
+        """LOINC codes that have records for a patient."""
+        return list(self.index.get(_patient_key(first_name, last_name), {}))
 
-        time_cols = ['valid_start_time', 'transaction_time']
-        for col in time_cols:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-            else:
-                raise ValueError(f"Required time column '{col}' not found in the file.")
-        
-        df['valid_stop_time'] = pd.to_datetime(df['valid_stop_time'], errors='coerce')
+    def lookup(self, first_name: str, last_name: str, loinc_code: str = None, current: bool = False) -> np.ndarray:
+        """Returns the row positions of a patient's records, optionally restricted to one LOINC code."""
+        entries = self.lookup_entries(first_name, last_name, loinc_code, current)
+        return np.concatenate([entry.positions for entry in entries]) if entries else _EMPTY_POSITIONS
 
-        end_of_time = pd.Timestamp.max
-        df['valid_stop_time'] = df['valid_stop_time'].fillna(end_of_time)
-        
-        return df
+    def _append_batch(self, new_df: pd.DataFrame, trace=NULL_TRACE, cancel_event=None):
+        """
+        Appends a prepared batch, already sorted by transaction time, to the table and the
+        index and publishes it as a new version. cancel_event is checked one last time once
+        the lock is held; after that the batch is committed and can no longer be cancelled.
+        """
+        with self.lock:
+            if cancel_event is not None and cancel_event.is_set():
+                raise InterruptedError("Loading was cancelled.")
+            if self.log is not None:
+                # Write-ahead: a batch that could not be logged is not applied either
+                with trace.stage('log_write'):
+                    self.log.append(new_df)
+            offset = len(self.df)
+            with trace.stage('concat'):
+                self.df = _concat_frames([self.df, new_df])
+            trace.rows(len(self.df))
+            with trace.stage('index_merge'):
+                self._merge_into_index(self._build_index(new_df, offset=offset))
+
+            earliest = new_df['transaction_time'].min()
+            self._append_history.append((self.version + 1, None if pd.isna(earliest) else earliest))
+            batch_latest = self._max_transaction_time(new_df)
+            if batch_latest is not None and (self.latest_transaction_time is None or batch_latest > self.latest_transaction_time):
+                self.latest_transaction_time = batch_latest
+            self.version += 1
 
-    def append_data_from_file(self, new_file_path: str):
+            if self.log is not None and self.compact_every and self.log.last_sequence - self._compacted_sequence >= self.compact_every:
+                try:
+                    with trace.stage('compact'):
+                        self.compact_log()
+                except OSError as e:
+                    # The batches are safe in the log; compaction is retried after the next append.
+                    print(f"Warning: could not compact the transaction log: {e}")
+
+    def append_data_from_file(self, new_file_path: str, progress=None, cancel_event=None):
         """
         Loads a new data file, prepares it, and appends it to the main DataFrame.
+        Rows are stored in ingestion order with each batch sorted by transaction time;
+        only the new batch is sorted, and it is merged into the index incrementally.
+        Safe to call from a worker thread: parsing runs without the lock and the data is
+        only locked while the batch is merged in. `progress` and `cancel_event` are passed
+        to the loader; a cancelled append leaves the data untouched.
         """
+        trace = self.profiler.trace('append_data_from_file')
         try:
+            start = time.perf_counter()
             print(f"Loading and preparing new data from: {new_file_path}")
-            new_df = self._load_and_prepare_data(new_file_path)
+            with trace.stage('parse'):
+                new_df = self._load_and_prepare_data(new_file_path, progress=progress, cancel_event=cancel_event)
+            trace.rows(len(new_df))
             
             if new_df.empty:
                 raise ValueError("The new data file is empty or could not be loaded.")
 
-            # Append the new data
-            self.df = pd.concat([self.df, new_df], ignore_index=True)
-            
-            # Crucially, re-sort the entire dataset by transaction time
-            self.df.sort_values(by='transaction_time', ascending=False, inplace=True)
+            # Sort just the batch; existing rows keep their positions, so the index stays valid
+            with trace.stage('sort'):
+                new_df = new_df.sort_values(by='transaction_time', kind='stable', ignore_index=True)
+            if progress is not None:
+                progress(f"Merging {len(new_df)} records...")
+
+            self._append_batch(new_df, trace, cancel_event)
             
-            print("Data appended and system re-sorted successfully.")
-            return {"success": True, "rows_added": len(new_df)}
+            elapsed = time.perf_counter() - start
+            print(f"Appended {len(new_df)} records in {elapsed:.3f}s.")
+            return trace.attach({"success": True, "rows_added": len(new_df), "elapsed_seconds": elapsed})
         
         except Exception as e:
             print(f"Error appending data: {e}")
-            return {"success": False, "error": str(e)}
+            return trace.attach({"success": False, "error": str(e)})
+
+    def bulk_load_files(self, file_paths: list, max_workers: int = None, chunk_rows: int = CHUNK_ROWS, progress=None, cancel_event=None):
+        """
+        Parses many data files in parallel worker processes and appends them as one batch.
+        Each worker returns its file as a prepared, compact frame; the parent concatenates
+        them, sorts once by transaction time and merges the result in a single append.
+        A file that fails to load is reported under "failures" and does not abort the rest.
+        Cancelling stops outstanding files and leaves the data untouched.
+        """
+        trace = self.profiler.trace('bulk_load_files')
+        start = time.perf_counter()
+        file_paths = list(file_paths)
+        frames, failures = {}, {}
+
+        def collect(path, load):
+            try:
+                frame = load()
+                if frame.empty:
+                    raise ValueError("The file is empty or could not be loaded.")
+                frames[path] = frame
+            except Exception as e:
+                print(f"Error loading {path}: {e}")
+                failures[path] = str(e)
+            if progress is not None:
+                progress(f"Parsed {len(frames) + len(failures)} of {len(file_paths)} files...")
+
+        workers = max(1, min(max_workers or os.cpu_count() or 1, len(file_paths)))
+        loinc_manager = self.loinc_manager
+        with trace.stage('parse'):
+            if workers == 1:
+                for path in file_paths:
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    collect(path, lambda: _parse_file(path, loinc_manager, chunk_rows, cancel_event=cancel_event))
+            else:
+                # Compile the lookup up front so every worker maps the same files instead of re-parsing the CSV
+                loinc_manager.lookup
+                initargs = (loinc_manager.file_path, loinc_manager.lookup_dir, loinc_manager.use_lookup_cache)
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_bulk_worker, initargs=initargs) as pool:
+                    futures = {pool.submit(_parse_file_in_worker, path, chunk_rows): path for path in file_paths}
+                    for future in as_completed(futures):
+                        if cancel_event is not None and cancel_event.is_set():
+                            pool.shutdown(wait=False, cancel_futures=True)
+                            break
+                        collect(futures[future], future.result)
+        trace.rows(sum(len(frame) for frame in frames.values()))
+
+        if cancel_event is not None and cancel_event.is_set():
+            return trace.attach({"success": False, "error": "Loading was cancelled.", "failures": failures})
+        if not frames:
+            return trace.attach({"success": False, "error": "None of the files could be loaded.", "failures": failures})
+
+        try:
+            # Files are concatenated in the order given so ties in transaction time stay deterministic
+            with trace.stage('sort'):
+                new_df = _concat_frames([frames[path] for path in file_paths if path in frames])
+                new_df = new_df.sort_values(by='transaction_time', kind='stable', ignore_index=True)
+            if progress is not None:
+                progress(f"Merging {len(new_df)} records...")
+            self._append_batch(new_df, trace, cancel_event)
+        except Exception as e:
+            print(f"Error appending data: {e}")
+            return trace.attach({"success": False, "error": str(e), "failures": failures})
+
+        elapsed = time.perf_counter() - start
+        print(f"Bulk loaded {len(new_df)} records from {len(frames)} files in {elapsed:.3f}s ({len(failures)} failed).")
+        return trace.attach({"success": True, "files_loaded": len(frames), "rows_added": len(new_df), "failures": failures, "elapsed_seconds": elapsed})
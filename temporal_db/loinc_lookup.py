@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+LOOKUP_FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+
+def default_lookup_dir(loinc_path: str) -> str:
+    """Compiled lookups live in the same hidden cache folder as the data snapshots."""
+    folder, name = os.path.split(os.path.abspath(loinc_path))
+    return os.path.join(folder, '.temporal_cache', f"{name}.lookup")
+
+def _name_hashes(names) -> np.ndarray:
+    """64-bit hashes of the lowercased names, stable across processes (unlike hash())."""
+    return np.fromiter((int.from_bytes(hashlib.blake2b(str(name).lower().encode('utf-8'), digest_size=8).digest(), 'little')
+                        for name in names), dtype=np.uint64, count=len(names))
+
+def read_loinc_csv(loinc_path: str) -> pd.DataFrame:
+    """Reads the (code, long name) pairs of a LOINC CSV; later rows win for repeated codes."""
+    df = pd.read_csv(loinc_path, header=None, names=['loinc_num', 'long_common_name'], usecols=[0, 1], dtype={'loinc_num': str})
+    df['loinc_num'] = df['loinc_num'].str.strip()
+    df = df.dropna().drop_duplicates(subset='loinc_num', keep='last')
+    return df.sort_values('loinc_num', kind='stable', ignore_index=True)
+
+class LoincLookup:
+    """
+    Read-only code -> name table held as flat arrays: the codes sorted as a fixed-width
+    string array (resolved with binary search), the names as one UTF-8 blob plus offsets,
+    and a reverse index of lowercased-name hashes for name -> codes lookups. Loaded from a
+    compiled lookup the arrays are memory-mapped, so opening it costs almost nothing.
+    """
+    def __init__(self, codes: np.ndarray, blob: np.ndarray, offsets: np.ndarray, name_hashes: np.ndarray, name_rows: np.ndarray):
+        self.codes = codes
+        self.blob = blob
+        self.offsets = offsets
+        self.name_hashes = name_hashes
+        self.name_rows = name_rows
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'LoincLookup':
+        """Builds the arrays from a frame sorted by code, as returned by read_loinc_csv."""
+        codes = np.asarray(df['loinc_num'].tolist(), dtype=str)
+        encoded = [str(name).encode('utf-8') for name in df['long_common_name']]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        hashes = _name_hashes(df['long_common_name'])
+        order = np.argsort(hashes, kind='stable')
+        return cls(codes, blob, offsets, hashes[order], order.astype(np.int32))
+
+    @classmethod
+    def empty(cls) -> 'LoincLookup':
+        return cls(np.empty(0, dtype='<U1'), np.empty(0, dtype=np.uint8), np.zeros(1, dtype=np.int64),
+                   np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int32))
+
+    def save(self, lookup_dir: str, signature: list):
+        """Writes the arrays to lookup_dir (via a temporary folder swapped in at the end)."""
+        tmp_dir = lookup_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name in ('codes', 'blob', 'offsets', 'name_hashes', 'name_rows'):
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+            json.dump({'version': LOOKUP_FORMAT_VERSION, 'signature': signature, 'codes': len(self)}, f)
+        shutil.rmtree(lookup_dir, ignore_errors=True)
+        os.replace(tmp_dir, lookup_dir)
+
+    @classmethod
+    def load(cls, lookup_dir: str, signature: list):
+        """Memory-maps a compiled lookup, or returns None if it is missing or stale."""
+        try:
+            with open(os.path.join(lookup_dir, META_FILE)) as f:
+                meta = json.load(f)
+            if meta.get('version') != LOOKUP_FORMAT_VERSION or meta.get('signature') != signature:
+                return None
+            arrays = [np.load(os.path.join(lookup_dir, f"{name}.npy"), mmap_mode='r')
+                      for name in ('codes', 'blob', 'offsets', 'name_hashes', 'name_rows')]
+        except (OSError, ValueError, KeyError):
+            return None
+        lookup = cls(*arrays)
+        return lookup if len(lookup) == meta['codes'] else None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _name(self, row: int) -> str:
+        return bytes(self.blob[self.offsets[row]:self.offsets[row + 1]]).decode('utf-8')
+
+    def rows_for(self, codes) -> np.ndarray:
+        """Row of each code in the table, -1 where the code is unknown."""
+        queries = np.asarray(codes, dtype=str)
+        if not len(self.codes) or not queries.size:
+            return np.full(queries.shape, -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.codes, queries), len(self.codes) - 1)
+        return np.where(self.codes[rows] == queries, rows, -1)
+
+    def names_for(self, codes: pd.Series) -> pd.Series:
+        """Vectorized code -> name; unknown codes map to NaN, like Series.map with a dict."""
+        rows = self.rows_for(codes.astype(str).to_numpy())
+        names = np.array([self._name(row) if row >= 0 else np.nan for row in rows], dtype=object)
+        return pd.Series(names, index=codes.index, dtype=object)
+
+    def get(self, code: str, default=None):
+        row = self.rows_for([str(code).strip()])[0]
+        return self._name(row) if row >= 0 else default
+
+    def __contains__(self, code) -> bool:
+        return self.rows_for([str(code).strip()])[0] >= 0
+
+    def codes_for_name(self, name: str) -> list:
+        """Codes whose long name equals name, ignoring case (reverse index lookup)."""
+        target = _name_hashes([name])[0]
+        lo, hi = np.searchsorted(self.name_hashes, target, side='left'), np.searchsorted(self.name_hashes, target, side='right')
+        # Hash collisions are confirmed against the stored name.
+        return [str(self.codes[row]) for row in self.name_rows[lo:hi] if self._name(row).lower() == name.lower()]
+
+    def to_dict(self) -> dict:
+        return {str(code): self._name(row) for row, code in enumerate(self.codes)}
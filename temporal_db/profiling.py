@@ -0,0 +1,160 @@
+import threading
+import time
+import tracemalloc
+from collections import deque
+import pandas as pd
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class _NullTrace:
+    """Stand-in used while profiling is off: every hook is a no-op, so instrumented code pays one call per stage."""
+    __slots__ = ()
+    _stage = _NullStage()
+
+    def stage(self, name: str):
+        return self._stage
+
+    def rows(self, count: int):
+        pass
+
+    def note(self, key: str, value):
+        pass
+
+    def attach(self, result):
+        return result
+
+NULL_TRACE = _NullTrace()
+
+class _Stage:
+    __slots__ = ('trace', 'name', 'start', 'memory_start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        if self.trace.track_memory:
+            tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        allocated = tracemalloc.get_traced_memory()[1] - self.memory_start if self.trace.track_memory else None
+        self.trace.stages.append({'stage': self.name, 'ms': seconds * 1000, 'rows': None, 'alloc_bytes': allocated})
+        return False
+
+class QueryTrace:
+    """
+    Timings of one operation, stage by stage. Stages are timed with `with trace.stage(name):`
+    and rows() records how many rows the stage that just finished produced. attach() closes
+    the trace, hands it to the profiler and, if the profiler attaches traces, adds it to a
+    result dict (or to a result DataFrame's attrs).
+    """
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.track_memory = profiler.track_memory
+        self.stages = []
+        self.notes = {}
+        self.start = time.perf_counter()
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def rows(self, count: int):
+        if self.stages:
+            self.stages[-1]['rows'] = int(count)
+
+    def note(self, key: str, value):
+        self.notes[key] = value
+
+    def to_dict(self) -> dict:
+        return {'operation': self.name, 'total_ms': self.total_ms, 'stages': list(self.stages), **self.notes}
+
+    def attach(self, result):
+        self.total_ms = (time.perf_counter() - self.start) * 1000
+        self.profiler.record(self)
+        if self.profiler.attach_traces and isinstance(result, dict):
+            result['trace'] = self.to_dict()
+        elif self.profiler.attach_traces and isinstance(result, pd.DataFrame):
+            result.attrs['trace'] = self.to_dict()
+        return result
+
+class Profiler:
+    """
+    Opt-in instrumentation shared by a TemporalDataManager and its query engines.
+    While disabled, trace() returns NULL_TRACE. Once enabled, every instrumented operation
+    records per-stage timings and row counts (plus memory allocated per stage with
+    track_memory, which runs tracemalloc and slows everything down noticeably), aggregated
+    by metrics() and kept as recent traces. Memory figures are process-wide, so they are only
+    meaningful while one operation runs at a time.
+    """
+    def __init__(self, enabled: bool = False, track_memory: bool = False, attach_traces: bool = False, keep_traces: int = 100):
+        self.enabled = False
+        self.track_memory = False
+        self.attach_traces = attach_traces
+        self._started_tracemalloc = False
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self.recent = deque(maxlen=keep_traces)
+        if enabled:
+            self.enable(track_memory, attach_traces)
+
+    def enable(self, track_memory: bool = False, attach_traces: bool = False):
+        """Starts profiling; attach_traces adds a "trace" entry to every query result dict (batch results: attrs)."""
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.track_memory = track_memory
+        self.attach_traces = attach_traces
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.track_memory = False
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def trace(self, name: str):
+        return QueryTrace(self, name) if self.enabled else NULL_TRACE
+
+    def record(self, trace: QueryTrace):
+        with self._lock:
+            self.recent.append(trace.to_dict())
+            entry = self._metrics.setdefault(trace.name, {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'stages': {}})
+            entry['calls'] += 1
+            entry['total_ms'] += trace.total_ms
+            entry['max_ms'] = max(entry['max_ms'], trace.total_ms)
+            for stage in trace.stages:
+                totals = entry['stages'].setdefault(stage['stage'], {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'alloc_bytes': 0})
+                totals['calls'] += 1
+                totals['total_ms'] += stage['ms']
+                totals['max_ms'] = max(totals['max_ms'], stage['ms'])
+                totals['rows'] += stage['rows'] or 0
+                totals['alloc_bytes'] += stage['alloc_bytes'] or 0
+
+    def metrics(self) -> dict:
+        """Aggregates per operation and stage: call counts, total/mean/max ms, rows and bytes allocated."""
+        with self._lock:
+            result = {}
+            for name, entry in self._metrics.items():
+                stages = {stage: dict(totals, mean_ms=totals['total_ms'] / totals['calls'], mean_rows=totals['rows'] / totals['calls'])
+                          for stage, totals in entry['stages'].items()}
+                result[name] = {'calls': entry['calls'], 'total_ms': entry['total_ms'], 'mean_ms': entry['total_ms'] / entry['calls'],
+                                'max_ms': entry['max_ms'], 'stages': stages}
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+            self.recent.clear()
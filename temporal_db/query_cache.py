@@ -0,0 +1,80 @@
+import sys
+import threading
+from collections import OrderedDict
+
+def _estimate_size(value) -> int:
+    """Rough size in bytes of a query result (dicts, lists of record dicts and scalars)."""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(k) + _estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+class QueryCache:
+    """
+    LRU cache of query results bounded by entry count and estimated size.
+    Entries remember the data manager version they were computed at. After an append,
+    an entry whose transaction time is strictly before the earliest transaction time
+    appended since stays valid (bi-temporal history before that point cannot change);
+    anything else, including "as of now" results, is dropped on the next lookup.
+    """
+    def __init__(self, data_manager, max_entries: int = 512, max_bytes: int = 64 * 1024 * 1024):
+        self.data_manager = data_manager
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached result for key, or None on a miss or a stale entry."""
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        current = self.data_manager.version
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] != current:
+            version, tt, size, result = entry
+            earliest = self.data_manager.earliest_transaction_since(version)
+            if tt is not None and (earliest is None or tt < earliest):
+                entry = self._entries[key] = (current, tt, size, result)
+            else:
+                self._remove(key)
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[3]
+
+    def put(self, key, tt, result, version: int):
+        """
+        Stores a result computed from data at least as new as `version` (read before the
+        query ran, so a concurrent append can only make the entry look older than it is).
+        tt is the transaction time the query was evaluated at, or None for "as of now".
+        """
+        size = _estimate_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, tt, size, result)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[2]
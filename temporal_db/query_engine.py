@@ -1,5 +1,9 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime, time
+from .data_manager import _map_categories, _normalize_name, _patient_key
+from .profiling import NULL_TRACE
+from .query_cache import QueryCache
 
 def _normalize_timezone(dt):
     """Helper function to ensure a datetime object is timezone-naive."""
@@ -7,78 +11,397 @@ def _normalize_timezone(dt):
         return dt.tz_localize(None)
     return dt
 
+def _to_naive_datetimes(values) -> pd.Series:
+    """Vectorized counterpart of _normalize_timezone for a column of datetimes."""
+    # format='mixed' parses each value on its own, like the scalar pd.to_datetime calls in the queries
+    series = pd.to_datetime(pd.Series(values), errors='coerce', format='mixed')
+    if getattr(series.dt, 'tz', None) is not None:
+        series = series.dt.tz_localize(None)
+    return series
+
+def _check_cancelled(cancel_event):
+    """Raises InterruptedError once cancel_event is set; queries call it between stages."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise InterruptedError("Query was cancelled.")
+
+class HistoryResult:
+    """
+    Lightweight handle over the rows of a history query. Rows stay in a DataFrame and are
+    only turned into record dicts a page at a time, so large histories can be displayed
+    incrementally without materializing every record up front.
+    """
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __sizeof__(self):
+        return int(self.frame.memory_usage(index=True, deep=True).sum())
+
+    def page(self, start: int, stop: int, columns: list = None) -> list:
+        """Returns rows [start, stop) as record dicts, optionally limited to some columns."""
+        rows = self.frame.iloc[start:stop]
+        return (rows[list(columns)] if columns is not None else rows).to_dict('records')
+
+    def to_records(self) -> list:
+        return self.frame.to_dict('records')
+
 class TemporalQueryEngine:
     """
     The core engine for performing bi-temporal queries on the medical dataset.
     """
-    def __init__(self, data_manager, loinc_manager):
-        self.df = data_manager.df
+    def __init__(self, data_manager, loinc_manager, cache_entries: int = 512, cache_bytes: int = 64 * 1024 * 1024):
+        self.data_manager = data_manager
         self.loinc_manager = loinc_manager
+        self.cache = QueryCache(data_manager, max_entries=cache_entries, max_bytes=cache_bytes)
+        # Shared with the data manager; see Profiler.enable().
+        self.profiler = data_manager.profiler
+
+    @property
+    def df(self) -> pd.DataFrame:
+        # Always read through the data manager so appends (and the index built for them) are picked up.
+        return self.data_manager.df
+
+    def _cached(self, key: tuple, tt, explicit_tt: bool, compute, trace=NULL_TRACE):
+        """
+        Returns a cached result for key or computes and caches it. "As of now" results are
+        only cached when every stored record is already known at tt, since otherwise the
+        answer could change as the clock moves past future-dated transactions.
+        """
+        with trace.stage('cache_lookup'):
+            result = self.cache.get(key)
+        trace.note('cache_hit', result is not None)
+        if result is None:
+            version = self.data_manager.version
+            result = compute()
+            if explicit_tt or self.data_manager.all_known_at(tt):
+                self.cache.put(key, tt if explicit_tt else None, result, version)
+        return dict(result)
 
     def point_in_time_query(self, first_name: str, last_name: str, loinc_code: str, 
-                              valid_time: str, transaction_time: str = None):
+                              valid_time: str, transaction_time: str = None, cancel_event=None):
         """
         Retrieves the value of a specific measurement for a patient, identified by LOINC code,
         at a given valid time, as known at a specific transaction time.
+        Without a transaction time the query reads the current-state view, which skips
+        superseded versions, as long as no stored record is dated after now.
+        Setting cancel_event stops the query at the next stage boundary.
         """
+        trace = self.profiler.trace('point_in_time_query')
         try:
-            vt = _normalize_timezone(pd.to_datetime(valid_time))
-            tt = _normalize_timezone(pd.to_datetime(transaction_time)) if transaction_time else _normalize_timezone(pd.to_datetime(datetime.now()))
-            is_date_only = vt.time() == time(0, 0)
-
-            patient_df = self.df[
-                (self.df['first_name'].str.lower() == first_name.lower()) &
-                (self.df['last_name'].str.lower() == last_name.lower()) &
-                (self.df['loinc_code'].str.strip() == loinc_code.strip())
-            ]
-
-            if patient_df.empty: return {"error": f"No records found for patient '{first_name} {last_name}' with LOINC code '{loinc_code}'."}
-            db_state_at_tt = patient_df[patient_df['transaction_time'] <= tt]
-            if db_state_at_tt.empty: return {"error": f"No records for this LOINC code were known to the system at {tt.strftime('%Y-%m-%d %H:%M')}."}
-            final_records = db_state_at_tt[(db_state_at_tt['valid_start_time'] <= vt) & (db_state_at_tt['valid_stop_time'] > vt)]
-            if final_records.empty: return {"error": f"No measurement found for the specified valid time: {vt.strftime('%Y-%m-%d %H:%M')}."}
-
-            result_record = final_records.sort_values(by='valid_start_time', ascending=False).iloc[0] if is_date_only else final_records.sort_values(by='transaction_time', ascending=False).iloc[0]
-            return result_record.to_dict()
+            with trace.stage('parse_times'):
+                vt = _normalize_timezone(pd.to_datetime(valid_time))
+                tt = _normalize_timezone(pd.to_datetime(transaction_time)) if transaction_time else _normalize_timezone(pd.to_datetime(datetime.now()))
+                is_date_only = vt.time() == time(0, 0)
 
+            current = not transaction_time and self.data_manager.all_known_at(tt)
+            key = ('point_in_time', *_patient_key(first_name, last_name), str(loinc_code).strip(), vt, tt if transaction_time else None)
+            return trace.attach(self._cached(key, tt, bool(transaction_time), lambda: self._point_in_time(first_name, last_name, loinc_code, vt, tt, is_date_only, current, trace, cancel_event), trace))
+
+        except InterruptedError as e:
+            return trace.attach({"error": str(e)})
         except Exception as e:
-            return {"error": f"An unexpected error occurred: {e}"}
+            return trace.attach({"error": f"An unexpected error occurred: {e}"})
+
+    def _point_in_time(self, first_name, last_name, loinc_code, vt, tt, is_date_only, current=False, trace=NULL_TRACE, cancel_event=None) -> dict:
+        with trace.stage('index_lookup'):
+            entries = self.data_manager.lookup_entries(first_name, last_name, loinc_code, current)
+        trace.rows(sum(len(entry) for entry in entries))
+        trace.note('current_state', current)
+        _check_cancelled(cancel_event)
+
+        if not entries: return {"error": f"No records found for patient '{first_name} {last_name}' with LOINC code '{loinc_code}'."}
+        entry = entries[0]
+        if not entry.any_known_at(tt.to_datetime64()): return {"error": f"No records for this LOINC code were known to the system at {tt.strftime('%Y-%m-%d %H:%M')}."}
+        with trace.stage('valid_and_known_filter'):
+            final_records = self.df.iloc[entry.valid_at(vt.to_datetime64(), tt.to_datetime64())]
+        trace.rows(len(final_records))
+        _check_cancelled(cancel_event)
+        if final_records.empty: return {"error": f"No measurement found for the specified valid time: {vt.strftime('%Y-%m-%d %H:%M')}."}
+
+        with trace.stage('sort'):
+            # Same ordering as point_in_time_batch: latest valid start for date-only valid times, latest
+            # transaction otherwise, the other time breaking ties and the later stored row winning after that.
+            by = ['valid_start_time', 'transaction_time'] if is_date_only else ['transaction_time', 'valid_start_time']
+            result_record = final_records.sort_values(by=by, kind='stable').iloc[-1]
+        with trace.stage('to_dict'):
+            return result_record.to_dict()
+
+    def point_in_time_batch(self, queries: pd.DataFrame) -> pd.DataFrame:
+        """
+        Resolves many point-in-time queries in one vectorized pass.
+        `queries` needs 'first_name', 'last_name', 'loinc_code' and 'valid_time' columns and may
+        have a 'transaction_time' column (missing/empty means now). Returns one row per query,
+        aligned with the input index, holding the selected record's columns plus an 'error'
+        column that carries the same message point_in_time_query would return (None on success).
+        When the profiler attaches traces, the trace is in result.attrs['trace'].
+        """
+        trace = self.profiler.trace('point_in_time_batch')
+        n = len(queries)
+        columns = list(self.df.columns)
+        with trace.stage('parse_times'):
+            raw_tt = pd.Series(queries['transaction_time'].to_numpy(dtype=object) if 'transaction_time' in queries.columns else [None] * n, dtype=object)
+            vt = _to_naive_datetimes(queries['valid_time'].to_numpy())
+            now = pd.Timestamp(datetime.now())
+            given = raw_tt.notna() & (raw_tt != '')
+            tt = _to_naive_datetimes(raw_tt.to_numpy()).where(given, now)
+            vt_ns, tt_ns = vt.to_numpy('datetime64[ns]'), tt.to_numpy('datetime64[ns]')
+            is_date_only = (vt == vt.dt.normalize()).to_numpy()
+
+        # Candidate (query, row) pairs come straight from the index; everything after is array math.
+        # Queries without a transaction time read the current-state view, decided per query as in point_in_time_query.
+        current = ~given.to_numpy() & self.data_manager.all_known_at(now)
+        trace.note('current_state', int(current.sum()))
+        with trace.stage('index_lookup'):
+            per_query = [self.data_manager.lookup(f, l, c, cur) for f, l, c, cur in
+                         zip(queries['first_name'].astype(str), queries['last_name'].astype(str), queries['loinc_code'].astype(str), current.tolist())]
+            counts = np.fromiter((len(p) for p in per_query), dtype=np.int64, count=n)
+            qid = np.repeat(np.arange(n), counts)
+            positions = np.concatenate(per_query) if n else np.empty(0, dtype=np.int64)
+        trace.rows(len(positions))
+
+        with trace.stage('known_filter'):
+            tx = self.df['transaction_time'].to_numpy('datetime64[ns]')[positions]
+            known = tx <= tt_ns[qid]
+        trace.rows(known.sum())
+        with trace.stage('valid_filter'):
+            vs = self.df['valid_start_time'].to_numpy('datetime64[ns]')[positions]
+            vstop = self.df['valid_stop_time'].to_numpy('datetime64[ns]')[positions]
+            valid = known & (vs <= vt_ns[qid]) & (vstop > vt_ns[qid])
+            has_known = np.bincount(qid[known], minlength=n) > 0
+            has_valid = np.bincount(qid[valid], minlength=n) > 0
+        trace.rows(valid.sum())
+
+        # Pick one record per query: latest valid start for date-only valid times, latest transaction otherwise.
+        with trace.stage('sort'):
+            v_qid, v_pos, v_tx, v_vs = qid[valid], positions[valid], tx[valid].view('i8'), vs[valid].view('i8')
+            primary = np.where(is_date_only[v_qid], v_vs, v_tx)
+            secondary = np.where(is_date_only[v_qid], v_tx, v_vs)
+            order = np.lexsort((secondary, primary, v_qid))
+            last_of_group = np.r_[v_qid[order][1:] != v_qid[order][:-1], True] if len(order) else np.empty(0, dtype=bool)
+            chosen = order[last_of_group]
+
+        with trace.stage('materialize'):
+            result = pd.DataFrame(index=np.arange(n), columns=columns, dtype=object)
+            if len(chosen):
+                result.iloc[v_qid[chosen]] = self.df.iloc[v_pos[chosen]][columns].to_numpy(dtype=object)
+
+            names = queries['first_name'].astype(str).to_numpy(dtype=object) + ' ' + queries['last_name'].astype(str).to_numpy(dtype=object)
+            errors = np.full(n, None, dtype=object)
+            no_valid = ~has_valid
+            errors[no_valid] = 'No measurement found for the specified valid time: ' + vt[no_valid].dt.strftime('%Y-%m-%d %H:%M').fillna('').to_numpy(dtype=object) + '.'
+            not_known = ~has_known
+            errors[not_known] = 'No records for this LOINC code were known to the system at ' + tt[not_known].dt.strftime('%Y-%m-%d %H:%M').fillna('').to_numpy(dtype=object) + '.'
+            no_rows = counts == 0
+            errors[no_rows] = ("No records found for patient '" + names[no_rows] + "' with LOINC code '"
+                               + queries['loinc_code'].astype(str).to_numpy(dtype=object)[no_rows] + "'.")
+            invalid = vt.isna().to_numpy() | tt.isna().to_numpy()
+            errors[invalid] = 'An unexpected error occurred: invalid valid_time or transaction_time.'
+            result['error'] = pd.Series(errors, index=result.index, dtype=object)
+            result.index = queries.index
+        trace.rows(len(chosen))
+        return trace.attach(result)
 
     def history_query(self, first_name: str, last_name: str, loinc_code: str = None, concept_name: str = None,
-                        valid_start: str = None, valid_end: str = None, transaction_time: str = None):
+                        valid_start: str = None, valid_end: str = None, transaction_time: str = None, as_handle: bool = False,
+                        latest_only: bool = False, cancel_event=None):
         """
         Retrieves the history of measurements for a patient where the measurement's start time
         falls within the given valid time range.
+        Every version known at the transaction time is returned, corrections included; with
+        latest_only=True only the latest version of each measurement is kept, which "as of now"
+        queries read straight from the current-state view.
+        With as_handle=True, "data" is a HistoryResult that renders rows on demand instead of
+        a list of record dicts. Setting cancel_event stops the query at the next stage boundary.
         """
+        trace = self.profiler.trace('history_query')
         try:
-            tt = _normalize_timezone(pd.to_datetime(transaction_time)) if transaction_time else _normalize_timezone(pd.to_datetime(datetime.now()))
-            # Set a more intuitive default for the start time if it's not provided.
-            vs = _normalize_timezone(pd.to_datetime(valid_start)) if valid_start else datetime(1, 1, 1, 0, 0)
-            ve = _normalize_timezone(pd.to_datetime(valid_end)) if valid_end else pd.Timestamp.max
+            with trace.stage('parse_times'):
+                tt = _normalize_timezone(pd.to_datetime(transaction_time)) if transaction_time else _normalize_timezone(pd.to_datetime(datetime.now()))
+                # Set a more intuitive default for the start time if it's not provided.
+                vs = _normalize_timezone(pd.to_datetime(valid_start)) if valid_start else pd.Timestamp.min
+                ve = _normalize_timezone(pd.to_datetime(valid_end)) if valid_end else pd.Timestamp.max
             
-            patient_df = self.df[
-                (self.df['first_name'].str.lower() == first_name.lower()) &
-                (self.df['last_name'].str.lower() == last_name.lower())
-            ]
-            
-            if loinc_code: patient_df = patient_df[patient_df['loinc_code'].str.strip() == loinc_code.strip()]
-            elif concept_name: patient_df = patient_df[patient_df['concept_name'].str.lower() == concept_name.lower()]
+            key = ('history', *_patient_key(first_name, last_name), loinc_code.strip() if loinc_code else None,
+                   concept_name.lower() if concept_name and not loinc_code else None, vs, ve, tt if transaction_time else None, latest_only)
+            current = latest_only and not transaction_time and self.data_manager.all_known_at(tt)
+            result = self._cached(key, tt, bool(transaction_time), lambda: self._history(first_name, last_name, loinc_code, concept_name, vs, ve, tt, latest_only, current, trace, cancel_event), trace)
+            if 'data' in result and not as_handle:
+                with trace.stage('to_records'):
+                    result['data'] = result['data'].to_records()
+            return trace.attach(result)
+
+        except InterruptedError as e:
+            return trace.attach({"error": str(e), "count": 0})
+        except Exception as e:
+            return trace.attach({"error": f"An unexpected error occurred: {e}", "count": 0})
 
-            if patient_df.empty: return {"error": "No records found for this patient and criteria.", "count": 0}
+    def _history(self, first_name, last_name, loinc_code, concept_name, vs, ve, tt, latest_only=False, current=False, trace=NULL_TRACE, cancel_event=None) -> dict:
+        with trace.stage('index_lookup'):
+            if not loinc_code and concept_name:
+                # The concept name is derived from the LOINC code, so the reverse LOINC index turns it into codes.
+                codes = self.loinc_manager.codes_for_name(concept_name, self.data_manager.patient_codes(first_name, last_name))
+                entries = self.data_manager.lookup_entries(first_name, last_name, codes, current)
+            else:
+                entries = self.data_manager.lookup_entries(first_name, last_name, loinc_code.strip() if loinc_code else None, current)
+        trace.rows(sum(len(entry) for entry in entries))
+        trace.note('current_state', current)
+        _check_cancelled(cancel_event)
 
-            db_state_at_tt = patient_df[patient_df['transaction_time'] <= tt]
-            if db_state_at_tt.empty: return {"error": f"No records were known to the system at {tt.strftime('%Y-%m-%d %H:%M')}.", "count": 0}
+        if not entries: return {"error": "No records found for this patient and criteria.", "count": 0}
 
-            final_records = db_state_at_tt[
-                (db_state_at_tt['valid_start_time'] >= vs) &
-                (db_state_at_tt['valid_start_time'] < ve)
-            ].copy()
+        if not any(entry.any_known_at(tt.to_datetime64()) for entry in entries): return {"error": f"No records were known to the system at {tt.strftime('%Y-%m-%d %H:%M')}.", "count": 0}
 
-            if final_records.empty: return {"error": "No measurements found that started in the specified valid time range.", "count": 0}
-            
+        # Each entry answers "started within [vs, ve) as known at tt" with two binary searches.
+        with trace.stage('valid_and_known_filter'):
+            # Entries whose view keeps every row still need the dedupe, so latest_only is always passed on.
+            positions = np.concatenate([entry.started_within(vs.to_datetime64(), ve.to_datetime64(), tt.to_datetime64(), latest_only) for entry in entries])
+        trace.rows(len(positions))
+        _check_cancelled(cancel_event)
+        with trace.stage('materialize'):
+            final_records = self.df.iloc[positions].copy()
+
+        if final_records.empty: return {"error": "No measurements found that started in the specified valid time range.", "count": 0}
+        
+        with trace.stage('sort'):
             final_records.sort_values(by='valid_start_time', ascending=True, inplace=True)
 
-            return {"data": final_records.to_dict('records'), "count": len(final_records)}
+        return {"data": HistoryResult(final_records), "count": len(final_records)}
+
+    def _cohort_codes(self, loinc_code: str = None, concept_name: str = None) -> list:
+        """LOINC codes a cohort query covers: the given code, or every code of the concept."""
+        if loinc_code:
+            return [loinc_code.strip()]
+        present = self.df['loinc_code'].astype('category').cat.categories.astype(str)
+        return self.loinc_manager.codes_for_name(concept_name, present)
+
+    def _with_patient_keys(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """Adds integer patient keys that group names the same way the index does (case/space-insensitive)."""
+        return rows.assign(_first=_map_categories(rows['first_name'], _normalize_name).cat.codes.to_numpy(),
+                           _last=_map_categories(rows['last_name'], _normalize_name).cat.codes.to_numpy())
+
+    def cohort_latest_query(self, loinc_code: str, valid_time: str, transaction_time: str = None, as_handle: bool = False, cancel_event=None):
+        """
+        Latest value of a LOINC code for every patient at a valid time, as known at a transaction
+        time. Each patient's record is picked exactly as point_in_time_query would pick it, but
+        for the whole table at once with grouped array operations.
+        """
+        trace = self.profiler.trace('cohort_latest_query')
+        try:
+            with trace.stage('parse_times'):
+                vt = _normalize_timezone(pd.to_datetime(valid_time))
+                tt = _normalize_timezone(pd.to_datetime(transaction_time)) if transaction_time else _normalize_timezone(pd.to_datetime(datetime.now()))
+                is_date_only = vt.time() == time(0, 0)
+
+            key = ('cohort_latest', str(loinc_code).strip(), vt, tt if transaction_time else None)
+            result = self._cached(key, tt, bool(transaction_time), lambda: self._cohort_latest(str(loinc_code).strip(), vt, tt, is_date_only, trace, cancel_event), trace)
+            if 'data' in result and not as_handle:
+                with trace.stage('to_records'):
+                    result['data'] = result['data'].to_records()
+            return trace.attach(result)
+
+        except InterruptedError as e:
+            return trace.attach({"error": str(e), "count": 0})
+        except Exception as e:
+            return trace.attach({"error": f"An unexpected error occurred: {e}", "count": 0})
+
+    def _cohort_latest(self, loinc_code, vt, tt, is_date_only, trace=NULL_TRACE, cancel_event=None) -> dict:
+        df = self.df
+        with trace.stage('code_filter'):
+            code_rows = (df['loinc_code'] == loinc_code).to_numpy()
+        trace.rows(code_rows.sum())
+        _check_cancelled(cancel_event)
+        if not code_rows.any(): return {"error": f"No records found with LOINC code '{loinc_code}'.", "count": 0}
+
+        with trace.stage('valid_and_known_filter'):
+            start = df['valid_start_time'].to_numpy('datetime64[ns]')
+            stop = df['valid_stop_time'].to_numpy('datetime64[ns]')
+            tx = df['transaction_time'].to_numpy('datetime64[ns]')
+            rows = code_rows & (tx <= tt.to_datetime64()) & (start <= vt.to_datetime64()) & (stop > vt.to_datetime64())
+            candidates = self._with_patient_keys(df.iloc[np.flatnonzero(rows)])
+        trace.rows(len(candidates))
+        _check_cancelled(cancel_event)
+        if candidates.empty: return {"error": f"No measurement found for the specified valid time: {vt.strftime('%Y-%m-%d %H:%M')}.", "count": 0}
+
+        # Same choice as the single-patient query: latest valid start for date-only valid times, latest transaction otherwise.
+        with trace.stage('sort'):
+            order = ['valid_start_time', 'transaction_time'] if is_date_only else ['transaction_time', 'valid_start_time']
+            latest = candidates.sort_values(order, kind='stable').drop_duplicates(['_first', '_last'], keep='last')
+            latest = latest.drop(columns=['_first', '_last']).sort_values(['last_name', 'first_name'], key=lambda col: col.astype(str).str.lower(), ignore_index=True)
+        trace.rows(len(latest))
+        return {"data": HistoryResult(latest), "count": len(latest)}
 
+    def cohort_aggregate_query(self, loinc_code: str = None, concept_name: str = None, valid_start: str = None,
+                               valid_end: str = None, transaction_time: str = None, as_handle: bool = False, cancel_event=None):
+        """
+        Count/min/max/mean of a LOINC code (or of every code of a concept) over measurements whose
+        valid start falls in [valid_start, valid_end), per patient and across all patients.
+        As of the transaction time, each measurement (patient, code, valid start) counts once,
+        with its latest known value, so superseded values do not skew the statistics.
+        """
+        if not loinc_code and not concept_name:
+            return {"error": "A LOINC code or a concept name is required.", "count": 0}
+        trace = self.profiler.trace('cohort_aggregate_query')
+        try:
+            with trace.stage('parse_times'):
+                tt = _normalize_timezone(pd.to_datetime(transaction_time)) if transaction_time else _normalize_timezone(pd.to_datetime(datetime.now()))
+                vs = _normalize_timezone(pd.to_datetime(valid_start)) if valid_start else pd.Timestamp.min
+                ve = _normalize_timezone(pd.to_datetime(valid_end)) if valid_end else pd.Timestamp.max
+
+            key = ('cohort_aggregate', loinc_code.strip() if loinc_code else None,
+                   concept_name.lower() if concept_name and not loinc_code else None, vs, ve, tt if transaction_time else None)
+            result = self._cached(key, tt, bool(transaction_time), lambda: self._cohort_aggregate(loinc_code, concept_name, vs, ve, tt, trace, cancel_event), trace)
+            if 'data' in result and not as_handle:
+                with trace.stage('to_records'):
+                    result['data'] = result['data'].to_records()
+            return trace.attach(result)
+
+        except InterruptedError as e:
+            return trace.attach({"error": str(e), "count": 0})
         except Exception as e:
-            return {"error": f"An unexpected error occurred: {e}", "count": 0}
+            return trace.attach({"error": f"An unexpected error occurred: {e}", "count": 0})
+
+    def _cohort_aggregate(self, loinc_code, concept_name, vs, ve, tt, trace=NULL_TRACE, cancel_event=None) -> dict:
+        df = self.df
+        with trace.stage('code_filter'):
+            codes = self._cohort_codes(loinc_code, concept_name)
+            code_rows = df['loinc_code'].isin(codes).to_numpy()
+        trace.rows(code_rows.sum())
+        _check_cancelled(cancel_event)
+        if not code_rows.any(): return {"error": "No records found for these criteria.", "count": 0}
+
+        with trace.stage('known_filter'):
+            tx = df['transaction_time'].to_numpy('datetime64[ns]')
+            known = code_rows & (tx <= tt.to_datetime64())
+        trace.rows(known.sum())
+        if not known.any(): return {"error": f"No records were known to the system at {tt.strftime('%Y-%m-%d %H:%M')}.", "count": 0}
+        with trace.stage('valid_filter'):
+            start = df['valid_start_time'].to_numpy('datetime64[ns]')
+            rows = known & (start >= vs.to_datetime64()) & (start < ve.to_datetime64())
+            measurements = self._with_patient_keys(df.iloc[np.flatnonzero(rows)])
+        trace.rows(len(measurements))
+        _check_cancelled(cancel_event)
+        if measurements.empty: return {"error": "No measurements found that started in the specified valid time range.", "count": 0}
+
+        # Keep the latest known version of every measurement, then aggregate the numeric values.
+        with trace.stage('sort'):
+            measurements = (measurements.assign(_code=measurements['loinc_code'].astype(str))
+                            .sort_values('transaction_time', kind='stable')
+                            .drop_duplicates(['_first', '_last', '_code', 'valid_start_time'], keep='last'))
+        trace.rows(len(measurements))
+        _check_cancelled(cancel_event)
+        with trace.stage('aggregate'):
+            measurements['_value'] = pd.to_numeric(measurements['value'], errors='coerce')
+            measurements['_non_numeric'] = measurements['_value'].isna() & measurements['value'].notna()
+            # count covers the numeric values min/max/mean are computed from; text values are counted apart
+            per_patient = measurements.groupby(['_first', '_last'], sort=False, observed=True).agg(
+                first_name=('first_name', 'first'), last_name=('last_name', 'first'), count=('_value', 'count'),
+                non_numeric=('_non_numeric', 'sum'), min=('_value', 'min'), max=('_value', 'max'), mean=('_value', 'mean'),
+                first_valid_start=('valid_start_time', 'min'), last_valid_start=('valid_start_time', 'max'))
+            per_patient = per_patient.sort_values(['last_name', 'first_name'], key=lambda col: col.astype(str).str.lower(), ignore_index=True)
+
+        values = measurements['_value']
+        summary = {"patients": len(per_patient), "measurements": int(values.count()), "non_numeric": int(measurements['_non_numeric'].sum()),
+                   "min": values.min(), "max": values.max(), "mean": values.mean()}
+        return {"data": HistoryResult(per_patient), "count": len(per_patient), "summary": summary}
@@ -0,0 +1,284 @@
+"""
+Headless HTTP/JSON service for the bi-temporal query engine.
+
+Loads the data once and serves many clients concurrently without Tk:
+
+    python -m temporal_db.server --data project_db_2025.xlsx --loinc LOINCTONAME.csv --port 8765
+
+Endpoints (all bodies are JSON):
+    GET  /health                 record count and data version
+    GET  /metrics                per-stage timings collected while started with --profile
+    POST /point_in_time          same parameters as TemporalQueryEngine.point_in_time_query
+    POST /point_in_time/batch    {"queries": [{...}, ...]} resolved in one vectorized pass
+    POST /history                history_query parameters plus optional "offset"/"limit"
+    POST /cohort/latest          cohort_latest_query parameters
+    POST /cohort/aggregate       cohort_aggregate_query parameters
+    POST /append                 {"file_path": "..."} appends a data file on the server
+
+/point_in_time requests are coalesced and answered by point_in_time_batch, so they skip the
+query cache and report an unparseable valid_time or transaction_time as
+"An unexpected error occurred: invalid valid_time or transaction_time." instead of the parser message.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+from .data_manager import LoincManager, TemporalDataManager
+from .profiling import Profiler
+from .query_engine import TemporalQueryEngine
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+def _json_default(value):
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return None if pd.isna(value) else value.isoformat()
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return None if np.isnan(value) else float(value)
+    if value is pd.NaT:
+        return None
+    return str(value)
+
+def _clean(value):
+    """Replaces float NaN (not valid JSON) with None, recursively."""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, dict):
+        return {k: _clean(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clean(v) for v in value]
+    return value
+
+def encode_json(payload) -> bytes:
+    return json.dumps(_clean(payload), default=_json_default).encode('utf-8')
+
+class PointInTimeBatcher:
+    """
+    Coalesces point-in-time requests that arrive within a short window into a single
+    point_in_time_batch call, so a burst of small requests costs one vectorized pass.
+    Answers therefore carry the batch error texts and do not go through the query cache.
+    """
+    def __init__(self, engine, executor, window_seconds: float = 0.002, max_batch: int = 512):
+        self.engine = engine
+        self.executor = executor
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._pending = []
+        self._flush_handle = None
+
+    async def submit(self, params: dict) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((params, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window_seconds, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if pending:
+            asyncio.ensure_future(self._run(pending))
+
+    async def _run(self, pending):
+        columns = ['first_name', 'last_name', 'loinc_code', 'valid_time', 'transaction_time']
+        queries = pd.DataFrame([[params.get(col) for col in columns] for params, _ in pending], columns=columns, dtype=object)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.engine.point_in_time_batch, queries)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_result({"error": f"An unexpected error occurred: {e}"})
+            return
+        for (_, future), (_, row) in zip(pending, results.iterrows()):
+            if future.done():
+                continue
+            record = row.to_dict()
+            error = record.pop('error')
+            future.set_result({"error": error} if error is not None else record)
+
+class QueryServer:
+    """Asyncio HTTP/1.1 server (with keep-alive) around one TemporalQueryEngine."""
+    def __init__(self, engine: TemporalQueryEngine, host: str = '127.0.0.1', port: int = 8765, workers: int = None):
+        self.engine = engine
+        self.data_manager = engine.data_manager
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(8, (os.cpu_count() or 1) + 2), thread_name_prefix='query-server')
+        self.batcher = PointInTimeBatcher(engine, self.executor)
+        self._server = None
+
+    async def start(self):
+        """Starts listening; with port=0 the chosen port is stored in self.port."""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, path, version = request_line.split(' ', 2)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Malformed request line."}, keep_alive=False)
+                    break
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != 'close' and version.strip() == 'HTTP/1.1'
+
+                length = headers.get('content-length', '0') or '0'
+                if not length.isdigit():
+                    await self._respond(writer, 400, {"error": "Invalid Content-Length header."}, keep_alive=False)
+                    break
+                length = int(length)
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "Request body too large."}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self._dispatch(method.upper(), path.split('?', 1)[0], body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status: int, payload, keep_alive: bool):
+        body = encode_json(payload)
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def _dispatch(self, method: str, path: str, body: bytes):
+        routes = {
+            '/health': ('GET', self._health),
+            '/metrics': ('GET', self._metrics),
+            '/point_in_time': ('POST', self._point_in_time),
+            '/point_in_time/batch': ('POST', self._point_in_time_batch),
+            '/history': ('POST', self._history),
+            '/cohort/latest': ('POST', self._cohort_latest),
+            '/cohort/aggregate': ('POST', self._cohort_aggregate),
+            '/append': ('POST', self._append),
+        }
+        if path not in routes:
+            return 404, {"error": f"Unknown endpoint '{path}'."}
+        expected_method, handler = routes[path]
+        if method != expected_method:
+            return 405, {"error": f"{path} expects {expected_method}."}
+        try:
+            params = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"error": "Request body is not valid JSON."}
+        if not isinstance(params, dict):
+            return 400, {"error": "Request body must be a JSON object."}
+        try:
+            return 200, await handler(params)
+        except (KeyError, TypeError, ValueError) as e:
+            return 400, {"error": f"Invalid request: {e}"}
+        except Exception as e:
+            return 500, {"error": f"An unexpected error occurred: {e}"}
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+
+    async def _health(self, params):
+        return {"status": "ok", "records": len(self.data_manager.df), "version": self.data_manager.version}
+
+    async def _metrics(self, params):
+        profiler = self.data_manager.profiler
+        return {"enabled": profiler.enabled, "metrics": profiler.metrics(), "recent": list(profiler.recent)[-20:]}
+
+    async def _point_in_time(self, params):
+        for required in ('first_name', 'last_name', 'loinc_code', 'valid_time'):
+            if not params.get(required):
+                raise ValueError(f"'{required}' is required.")
+        return await self.batcher.submit(params)
+
+    async def _point_in_time_batch(self, params):
+        queries = pd.DataFrame(params['queries'], dtype=object)
+        results = await self._run(self.engine.point_in_time_batch, queries)
+        records = results.astype(object).where(results.notna(), None).to_dict('records')
+        return {"results": records}
+
+    async def _history(self, params):
+        offset, limit = int(params.pop('offset', 0)), params.pop('limit', None)
+        result = await self._run(self.engine.history_query, **params, as_handle=True)
+        if 'data' in result:
+            stop = len(result['data']) if limit is None else offset + int(limit)
+            result['data'] = result['data'].page(offset, stop)
+            result['offset'] = offset
+        return result
+
+    async def _cohort_latest(self, params):
+        return await self._run(self.engine.cohort_latest_query, **params)
+
+    async def _cohort_aggregate(self, params):
+        return await self._run(self.engine.cohort_aggregate_query, **params)
+
+    async def _append(self, params):
+        return await self._run(self.data_manager.append_data_from_file, params['file_path'])
+
+def main(argv=None):
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Serve the bi-temporal query engine over HTTP/JSON.")
+    parser.add_argument('--data', default=os.path.join(project_root, 'project_db_2025.xlsx'))
+    parser.add_argument('--loinc', default=os.path.join(project_root, 'LOINCTONAME.csv'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--profile', action='store_true', help="Collect per-stage timings, served at /metrics")
+    parser.add_argument('--profile-memory', action='store_true', help="With --profile, also track allocations per stage (slow)")
+    args = parser.parse_args(argv)
+
+    loinc_manager = LoincManager.shared(args.loinc)
+    profiler = Profiler(enabled=args.profile, track_memory=args.profile_memory)
+    data_manager = TemporalDataManager(file_path=args.data, loinc_manager=loinc_manager, profiler=profiler)
+    if data_manager.df.empty:
+        raise SystemExit("Failed to load data. Check console for details.")
+    engine = TemporalQueryEngine(data_manager, loinc_manager)
+    server = QueryServer(engine, host=args.host, port=args.port, workers=args.workers)
+    print(f"Serving {len(data_manager.df)} records on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        data_manager.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import io
+import json
+import os
+import shutil
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_FORMAT_VERSION = 4
+META_FILE = 'meta.json'
+# Type tags of mixed-type categories, which are stored as text (nothing is ever pickled)
+CATEGORY_TYPES = {str: 0, int: 1, float: 2, bool: 3, pd.Timestamp: 4}
+CATEGORY_PARSERS = {0: str, 1: int, 2: float, 3: lambda text: text == 'True', 4: pd.Timestamp}
+
+def source_signature(*paths) -> list:
+    """
+    Cheap fingerprint of the files a snapshot was derived from (absolute path, size, mtime).
+    A snapshot is only reused while every fingerprint still matches.
+    """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+        except (OSError, TypeError):
+            signature.append([os.path.abspath(str(path)), None, None])
+    return signature
+
+def default_snapshot_dir(file_path: str) -> str:
+    """Snapshots live in a hidden cache folder next to the source file."""
+    folder, name = os.path.split(os.path.abspath(file_path))
+    return os.path.join(folder, '.temporal_cache', f"{name}.snapshot")
+
+def _column_file(snapshot_dir: str, index: int, part: str) -> str:
+    return os.path.join(snapshot_dir, f"col{index}_{part}.npy")
+
+def _category_type(value) -> int:
+    if isinstance(value, (bool, np.bool_)):
+        return CATEGORY_TYPES[bool]
+    if isinstance(value, (int, np.integer)):
+        return CATEGORY_TYPES[int]
+    if isinstance(value, (float, np.floating)):
+        return CATEGORY_TYPES[float]
+    if isinstance(value, str):
+        return CATEGORY_TYPES[str]
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return CATEGORY_TYPES[pd.Timestamp]
+    raise TypeError(f"cannot store a value of type {type(value).__name__} ({value!r})")
+
+def _encode_categories(categories: pd.Index) -> dict:
+    """
+    Categories as plain arrays: numeric and datetime ones as they are, strings as a fixed-width
+    unicode array, and mixed types (e.g. a value column holding numbers and text) as text plus
+    a type tag per category.
+    """
+    if not (categories.dtype == object or pd.api.types.is_string_dtype(categories.dtype)):
+        return {'categories': categories.to_numpy()}
+    values = list(categories)
+    if all(isinstance(value, str) for value in values):
+        return {'categories': np.asarray(values, dtype=str)}
+    types = [_category_type(value) for value in values]
+    text = [pd.Timestamp(value).isoformat() if kind == CATEGORY_TYPES[pd.Timestamp] else repr(float(value)) if kind == CATEGORY_TYPES[float] else str(value)
+            for value, kind in zip(values, types)]
+    return {'categories': np.asarray(text, dtype=str), 'category_types': np.asarray(types, dtype=np.uint8)}
+
+def _encode_column(series: pd.Series):
+    """
+    Splits a column into plain arrays: datetime and numeric columns are stored raw
+    (memory-mappable on load); categorical columns keep their codes and categories, and any
+    other column is dictionary-encoded the same way. Returns (kind, {part: array}).
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime', {'values': series.to_numpy(dtype='datetime64[ns]')}
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return 'categorical', {'codes': series.cat.codes.to_numpy(), **_encode_categories(series.cat.categories)}
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return 'numeric', {'values': series.to_numpy()}
+    codes, categories = pd.factorize(series, use_na_sentinel=True)
+    return 'categorical', {'codes': codes.astype(np.int32), **_encode_categories(pd.Index(categories, dtype=object))}
+
+def _decode_column(column: dict, load):
+    """Inverse of _encode_column; load(part) returns the stored array for that part."""
+    if column['kind'] != 'categorical':
+        return load('values')
+    codes = load('codes')
+    categories = load('categories')
+    if 'category_types' in column['parts']:
+        categories = np.array([CATEGORY_PARSERS[kind](text) for text, kind in zip(categories.tolist(), load('category_types').tolist())], dtype=object)
+    if column['dtype'] == 'category':
+        return pd.Categorical.from_codes(np.asarray(codes), categories=pd.Index(categories))
+    # Code -1 (missing) picks the trailing NaN sentinel.
+    values = pd.Series(np.append(np.asarray(categories, dtype=object), np.nan)[codes], dtype=object)
+    return values if column['dtype'] == 'object' else values.astype(column['dtype'])
+
+def encode_frame(df: pd.DataFrame) -> bytes:
+    """Serializes a prepared DataFrame into one compact buffer, column by column like a snapshot."""
+    columns, buffers = [], []
+    for col in df.columns:
+        kind, parts = _encode_column(df[col])
+        sizes = {}
+        for part, array in parts.items():
+            buffer = io.BytesIO()
+            np.save(buffer, array, allow_pickle=False)
+            buffers.append(buffer.getvalue())
+            sizes[part] = len(buffers[-1])
+        columns.append({'name': col, 'kind': kind, 'dtype': str(df[col].dtype), 'parts': sizes})
+    header = json.dumps({'rows': len(df), 'columns': columns}).encode('utf-8')
+    return len(header).to_bytes(4, 'little') + header + b''.join(buffers)
+
+def decode_frame(data: bytes) -> pd.DataFrame:
+    """Inverse of encode_frame."""
+    header_length = int.from_bytes(data[:4], 'little')
+    meta = json.loads(data[4:4 + header_length].decode('utf-8'))
+    offset, result = 4 + header_length, {}
+    for column in meta['columns']:
+        arrays = {}
+        for part, size in column['parts'].items():
+            arrays[part] = np.load(io.BytesIO(data[offset:offset + size]), allow_pickle=False)
+            offset += size
+        result[column['name']] = _decode_column(column, arrays.__getitem__)
+    df = pd.DataFrame(result)
+    if len(df) != meta['rows']:
+        raise ValueError(f"expected {meta['rows']} rows, decoded {len(df)}")
+    return df
+
+def save_snapshot(df: pd.DataFrame, snapshot_dir: str, signature: list, **extra):
+    """
+    Persists a prepared DataFrame as one .npy file per column (see _encode_column).
+    Keyword arguments are stored in the metadata alongside the signature.
+    The snapshot is written to a temporary folder and swapped in at the end (the previous
+    one is moved aside first and only deleted once the new one is in place), so a crash
+    never leaves a half-written snapshot behind and never leaves no snapshot at all.
+    """
+    _recover_snapshot(snapshot_dir)
+    tmp_dir = snapshot_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        kind, parts = _encode_column(df[col])
+        for part, array in parts.items():
+            np.save(_column_file(tmp_dir, i, part), array, allow_pickle=False)
+        columns.append({'name': col, 'kind': kind, 'dtype': str(df[col].dtype), 'parts': list(parts)})
+
+    meta = dict(extra, version=SNAPSHOT_FORMAT_VERSION, signature=signature, rows=len(df), columns=columns)
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    old_dir = snapshot_dir + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(snapshot_dir):
+        os.replace(snapshot_dir, old_dir)
+    os.replace(tmp_dir, snapshot_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def _recover_snapshot(snapshot_dir: str):
+    """
+    Finishes a swap interrupted by a crash in save_snapshot: if the snapshot folder is
+    missing, the complete new snapshot (.tmp, whose metadata is written last) or else the
+    previous one (.old) is moved into place. After compaction the snapshot may be the only
+    copy of appended batches, so it must not be lost between the two renames.
+    """
+    if os.path.exists(os.path.join(snapshot_dir, META_FILE)):
+        shutil.rmtree(snapshot_dir + '.old', ignore_errors=True)
+        return
+    for candidate in (snapshot_dir + '.tmp', snapshot_dir + '.old'):
+        if os.path.exists(os.path.join(candidate, META_FILE)):
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            os.replace(candidate, snapshot_dir)
+            shutil.rmtree(snapshot_dir + '.old', ignore_errors=True)
+            print(f"Recovered the snapshot at {snapshot_dir} from an interrupted save.")
+            return
+
+def read_snapshot_meta(snapshot_dir: str):
+    """The metadata of a snapshot, or None if there is no readable snapshot."""
+    try:
+        _recover_snapshot(snapshot_dir)
+    except OSError as e:
+        print(f"Warning: could not recover the snapshot at {snapshot_dir}: {e}")
+    try:
+        with open(os.path.join(snapshot_dir, META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == SNAPSHOT_FORMAT_VERSION else None
+
+def _load_columns(snapshot_dir: str, meta: dict):
+    try:
+        data = {}
+        for i, column in enumerate(meta['columns']):
+            load = lambda part: np.load(_column_file(snapshot_dir, i, part), mmap_mode=None if part == 'categories' else 'r', allow_pickle=False)
+            data[column['name']] = _decode_column(column, load)
+        df = pd.DataFrame(data)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Warning: ignoring unreadable snapshot at {snapshot_dir}: {e}")
+        return None
+    return df if len(df) == meta['rows'] else None
+
+def load_snapshot(snapshot_dir: str, signature: list):
+    """
+    Loads a snapshot written by save_snapshot, or returns None if it is missing,
+    unreadable, or was built from different source files.
+    """
+    meta = read_snapshot_meta(snapshot_dir)
+    if meta is None or meta.get('signature') != signature:
+        return None
+    if signature[0][1] is None:
+        # The primary source file is gone; never serve data for it from cache.
+        return None
+    return _load_columns(snapshot_dir, meta)
+
+def load_snapshot_rows(snapshot_dir: str):
+    """
+    (metadata, rows) of a snapshot regardless of its signature, e.g. the appended rows that
+    compact_log keeps next to the transaction log; (None, None) if missing or unreadable.
+    """
+    meta = read_snapshot_meta(snapshot_dir)
+    df = _load_columns(snapshot_dir, meta) if meta is not None else None
+    return (None, None) if df is None else (meta, df)
@@ -0,0 +1,104 @@
+import numpy as np
+
+# valid_stop_time of a measurement without an end (pd.Timestamp.max, what the loader fills in).
+END_OF_TIME = np.datetime64(np.iinfo(np.int64).max, 'ns')
+
+def _last_per_start(start: np.ndarray) -> np.ndarray:
+    """Mask of the last row of every run of equal valid start times (rows sorted by start, then tx)."""
+    return np.r_[start[1:] != start[:-1], True] if len(start) else np.empty(0, dtype=bool)
+
+class TemporalIndex:
+    """
+    Sorted-array index over the records of one (patient, LOINC code) pair.
+    Rows are kept ordered by valid start time (then transaction time), so the bi-temporal
+    predicates used by the query engine start with a binary search instead of a full mask.
+    All time arrays are datetime64[ns] and query bounds are np.datetime64 scalars;
+    positions point into the data manager's DataFrame.
+    For "valid at vt" lookups the entry also keeps the longest validity span of its bounded
+    rows and the rows that never end: bounded rows that started more than that span before
+    vt cannot be valid any more, so only a window of the sorted arrays has to be scanned.
+    Entries are never modified (merging returns a new one), so the current-state view of an
+    entry is materialized once, on first use, and only rebuilt for entries an append replaces.
+    """
+    __slots__ = ('positions', 'start', 'stop', 'tx', 'min_tx', 'open_rows', 'max_span', '_current')
+
+    def __init__(self, positions, start, stop, tx):
+        order = np.lexsort((tx, start))
+        self.positions = np.asarray(positions, dtype=np.int64)[order]
+        self.start = np.asarray(start, dtype='datetime64[ns]')[order]
+        self.stop = np.asarray(stop, dtype='datetime64[ns]')[order]
+        self.tx = np.asarray(tx, dtype='datetime64[ns]')[order]
+        known = self.tx[~np.isnat(self.tx)]
+        self.min_tx = known.min() if len(known) else np.datetime64('NaT', 'ns')
+        open_ended = self.stop == END_OF_TIME
+        bounded = ~open_ended & ~np.isnat(self.start) & ~np.isnat(self.stop)
+        self.open_rows = np.flatnonzero(open_ended)
+        self.max_span = max(int((self.stop[bounded] - self.start[bounded]).max().astype(np.int64)), 0) if bounded.any() else 0
+        self._current = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def merged(self, other: 'TemporalIndex') -> 'TemporalIndex':
+        """Returns a new index holding the rows of both indexes."""
+        return TemporalIndex(np.concatenate([self.positions, other.positions]),
+                             np.concatenate([self.start, other.start]),
+                             np.concatenate([self.stop, other.stop]),
+                             np.concatenate([self.tx, other.tx]))
+
+    def current_state(self) -> 'TemporalIndex':
+        """
+        The latest-known version of every measurement: for each valid start time only the row
+        with the latest transaction time (the last appended on ties), superseded rows and rows
+        without a transaction time dropped.
+        Point lookups on it give the same answer as on the full entry with everything known,
+        as long as every version of a measurement has the same valid stop time. If a correction
+        changed the stop time, an older version can be valid where the latest is not, so such
+        entries keep every known row.
+        """
+        if self._current is None:
+            # Rows without a transaction time are never known, so they cannot supersede anything
+            known = ~np.isnat(self.tx)
+            entry = self if known.all() else TemporalIndex(self.positions[known], self.start[known], self.stop[known], self.tx[known])
+            latest = _last_per_start(entry.start)
+            # Run of equal start times each row belongs to, and the stop time of that run's latest row
+            run = np.cumsum(latest) - latest
+            uniform_stops = np.array_equal(entry.stop, entry.stop[np.flatnonzero(latest)][run])
+            self._current = entry if latest.all() or not uniform_stops else TemporalIndex(entry.positions[latest], entry.start[latest], entry.stop[latest], entry.tx[latest])
+            self._current._current = self._current
+        return self._current
+
+    def any_known_at(self, tt) -> bool:
+        """True if at least one record had been recorded by transaction time tt."""
+        return not np.isnat(self.min_tx) and self.min_tx <= np.datetime64(tt, 'ns')
+
+    def valid_at(self, vt, tt) -> np.ndarray:
+        """
+        Positions of records valid at vt (start <= vt < stop) as known at tt, in entry order.
+        Costs two binary searches plus a scan of the bounded rows that started within max_span
+        before vt and of the open-ended rows that started earlier. Open-ended rows are valid
+        at every later vt, so for data without stop times the result itself, and the cost,
+        grow with the number of rows that started before vt.
+        """
+        vt, tt = np.datetime64(vt, 'ns'), np.datetime64(tt, 'ns')
+        end = np.searchsorted(self.start, vt, side='right')
+        if len(self.open_rows) == len(self.positions):
+            return self.positions[:end][self.tx[:end] <= tt]
+        lower = int(vt.astype(np.int64)) - self.max_span
+        begin = np.searchsorted(self.start, np.datetime64(lower, 'ns'), side='left') if lower > np.iinfo(np.int64).min else 0
+        earlier = self.open_rows[:np.searchsorted(self.open_rows, begin)]
+        earlier = earlier[self.tx[earlier] <= tt]
+        mask = (self.stop[begin:end] > vt) & (self.tx[begin:end] <= tt)
+        return np.concatenate([self.positions[earlier], self.positions[begin:end][mask]])
+
+    def started_within(self, vs, ve, tt, latest_only: bool = False) -> np.ndarray:
+        """
+        Positions of records whose valid start falls in [vs, ve), as known at tt. With
+        latest_only, versions superseded by a correction known at tt are left out.
+        """
+        vs, ve, tt = np.datetime64(vs, 'ns'), np.datetime64(ve, 'ns'), np.datetime64(tt, 'ns')
+        begin = np.searchsorted(self.start, vs, side='left')
+        end = np.searchsorted(self.start, ve, side='left')
+        known = self.tx[begin:end] <= tt
+        positions = self.positions[begin:end][known]
+        return positions[_last_per_start(self.start[begin:end][known])] if latest_only else positions
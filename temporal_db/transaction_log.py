@@ -0,0 +1,203 @@
+import os
+import struct
+import zlib
+import pandas as pd
+from .snapshot import decode_frame, encode_frame
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Record header: magic, sequence number, payload length, CRC32 of (sequence, length, payload).
+RECORD_HEADER = struct.Struct('<4sQQI')
+RECORD_MAGIC = b'TDL1'
+SEGMENT_BYTES = 64 * 1024 * 1024
+LOCK_FILE = 'lock'
+
+def default_log_dir(file_path: str) -> str:
+    """
+    The log of appended batches lives in a data folder next to the base file. Unlike the
+    snapshots in .temporal_cache it is not derived from anything and must not be deleted.
+    """
+    folder, name = os.path.split(os.path.abspath(file_path))
+    return os.path.join(folder, '.temporal_data', name)
+
+def _checksum(sequence: int, payload: bytes) -> int:
+    return zlib.crc32(payload, zlib.crc32(struct.pack('<QQ', sequence, len(payload))))
+
+def _fsync_dir(path: str):
+    # Makes a newly created segment durable; directories cannot be opened on Windows.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _try_lock(handle) -> bool:
+    """Takes an exclusive lock on an open file without waiting; False if another process holds it."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+class TransactionLog:
+    """
+    Append-only on-disk log of ingested batches. Every batch is one record (header plus the
+    batch encoded with encode_frame) carrying a sequence number, written and fsynced before
+    the batch becomes visible. Records go to segment files named after their first sequence
+    number; segments are rotated at segment_bytes so compaction can drop whole files.
+    A torn or corrupt record (e.g. after a crash mid-write) ends the log: it is cut off on
+    replay and everything before it is kept.
+    The log directory is locked until close() (the OS drops the lock if the process dies).
+    A second instance on the same directory opens it read-only: it replays without
+    repairing anything and refuses appends.
+    """
+    def __init__(self, log_dir: str, segment_bytes: int = SEGMENT_BYTES):
+        self.log_dir = log_dir
+        self.segment_bytes = segment_bytes
+        self.last_sequence = 0
+        # (segment, size) of a failed append whose partial record could not be cut off yet
+        self._pending_rollback = None
+        os.makedirs(log_dir, exist_ok=True)
+        self._lock_handle = open(os.path.join(log_dir, LOCK_FILE), 'a+b')
+        self.read_only = not _try_lock(self._lock_handle)
+        if self.read_only:
+            print(f"Warning: transaction log {log_dir} is in use by another process; opened read-only.")
+
+    def close(self):
+        """Releases the lock on the log directory; the log is read-only afterwards."""
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
+        self.read_only = True
+
+    def _segments(self) -> list:
+        """(first sequence, path) of every segment, oldest first."""
+        try:
+            names = os.listdir(self.log_dir)
+        except FileNotFoundError:
+            return []
+        segments = []
+        for name in names:
+            stem, extension = os.path.splitext(name)
+            if extension == '.seg' and stem.isdigit():
+                segments.append((int(stem), os.path.join(self.log_dir, name)))
+        return sorted(segments)
+
+    def replay(self, after_sequence: int = 0) -> list:
+        """
+        Reads the log, verifying every record, and returns the batches with a sequence number
+        above after_sequence in order. Sets last_sequence to the last intact record.
+        """
+        batches, expected = [], None
+        segments = self._segments()
+        if segments and segments[0][0] > after_sequence + 1:
+            print(f"Warning: transaction log {self.log_dir} is missing records {after_sequence + 1} to {segments[0][0] - 1}.")
+        for i, (first, path) in enumerate(segments):
+            with open(path, 'rb') as f:
+                data = f.read()
+            offset, error = 0, None
+            while offset < len(data):
+                if len(data) - offset < RECORD_HEADER.size:
+                    error = "truncated record header"
+                    break
+                magic, sequence, length, checksum = RECORD_HEADER.unpack_from(data, offset)
+                payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+                if magic != RECORD_MAGIC or len(payload) != length or _checksum(sequence, payload) != checksum:
+                    error = "truncated or corrupt record"
+                    break
+                if expected is not None and sequence != expected:
+                    error = f"expected sequence {expected}, found {sequence}"
+                    break
+                if sequence > after_sequence:
+                    try:
+                        batches.append(decode_frame(payload))
+                    except (ValueError, KeyError, TypeError) as e:
+                        # The record is intact, so it is not cut off; it needs a reader that understands it.
+                        raise ValueError(f"Transaction log record {sequence} in {path} could not be decoded "
+                                         f"(written by another version?): {e}") from e
+                self.last_sequence, expected = sequence, sequence + 1
+                offset += RECORD_HEADER.size + length
+            if error is not None:
+                if self.read_only:
+                    print(f"Warning: transaction log {path} is damaged at byte {offset} ({error}); later records are skipped.")
+                else:
+                    self._cut(path, offset, [later for _, later in segments[i + 1:]], error)
+                break
+        self.last_sequence = max(self.last_sequence, after_sequence)
+        return batches
+
+    def _cut(self, path: str, offset: int, later_segments: list, reason: str):
+        """Drops everything from a bad record on, so new records continue after the last good one."""
+        print(f"Warning: transaction log {path} is damaged at byte {offset} ({reason}); later records are discarded.")
+        with open(path, 'r+b') as f:
+            f.truncate(offset)
+        for later in later_segments:
+            os.replace(later, later + '.corrupt')
+
+    def _rollback(self, path: str, size: int):
+        """Cuts a partially written record off the end of a segment (removing a segment it created)."""
+        if size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+                os.fsync(f.fileno())
+        elif os.path.exists(path):
+            os.remove(path)
+        self._pending_rollback = None
+
+    def append(self, df: pd.DataFrame) -> int:
+        """
+        Durably writes a batch and returns its sequence number. If the write fails, whatever
+        part of the record reached the segment is cut off again before the error is raised,
+        so a later append never lands behind a torn record (which replay would stop at).
+        """
+        if self.read_only:
+            raise PermissionError(f"The transaction log {self.log_dir} is in use by another process or closed; appends are refused.")
+        if self._pending_rollback is not None:
+            self._rollback(*self._pending_rollback)
+        payload = encode_frame(df)
+        sequence = self.last_sequence + 1
+        record = RECORD_HEADER.pack(RECORD_MAGIC, sequence, len(payload), _checksum(sequence, payload)) + payload
+
+        segments = self._segments()
+        path = segments[-1][1] if segments else None
+        if path is None or (os.path.getsize(path) > 0 and os.path.getsize(path) + len(record) > self.segment_bytes):
+            path = os.path.join(self.log_dir, f"{sequence:012d}.seg")
+        created = not os.path.exists(path)
+        size = 0 if created else os.path.getsize(path)
+        try:
+            with open(path, 'ab') as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            self._pending_rollback = (path, size)
+            try:
+                self._rollback(path, size)
+            except OSError as e:
+                print(f"Warning: could not undo a partial write to {path} ({e}); retrying before the next append.")
+            raise
+        if created:
+            _fsync_dir(self.log_dir)
+        self.last_sequence = sequence
+        return sequence
+
+    def discard_through(self, sequence: int):
+        """Deletes the segments whose records all have sequence numbers up to `sequence`."""
+        segments = self._segments()
+        for i, (first, path) in enumerate(segments):
+            last = segments[i + 1][0] - 1 if i + 1 < len(segments) else self.last_sequence
+            if last <= sequence:
+                os.remove(path)
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(path) for _, path in self._segments())
@@ -0,0 +1,85 @@
+"""
+Queries without a transaction time read the current-state view; they must answer exactly
+like the same query with transaction_time set to now.
+"""
+import os
+import sys
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic import generate_dataset
+from temporal_db.data_manager import LoincManager, TemporalDataManager
+from temporal_db.query_engine import TemporalQueryEngine
+
+def _engine(tmp_path, raw: pd.DataFrame) -> TemporalQueryEngine:
+    path = os.path.join(tmp_path, 'data.csv')
+    raw.to_csv(path, index=False)
+    loinc_manager = LoincManager(os.path.join(tmp_path, 'missing_loinc.csv'))
+    data_manager = TemporalDataManager(path, loinc_manager, use_snapshot=False, use_log=False)
+    return TemporalQueryEngine(data_manager, loinc_manager, cache_entries=0)
+
+def _rows(*rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=['First name', 'Last name', 'LOINC-NUM', 'Value', 'Unit', 'Valid start time', 'Valid stop time', 'Transaction time'])
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+@pytest.fixture
+def shortened_stop(tmp_path):
+    # A later correction shortens the validity of the measurement that started at 10:00
+    return _engine(tmp_path, _rows(('Eyal', 'Rothman', '11218-5', 1.0, 'x', '2018-05-17 10:00', None, '2018-05-17 12:00'),
+                                   ('Eyal', 'Rothman', '11218-5', 2.0, 'x', '2018-05-17 10:00', '2018-05-17 11:00', '2018-05-18 12:00'),
+                                   ('Eyal', 'Rothman', '11218-5', 3.0, 'x', '2018-05-17 08:00', None, '2018-05-17 09:00')))
+
+@pytest.mark.parametrize('valid_time', ['2018-05-17 12:00', '2018-05-17 10:30', '2018-05-17 09:00', '2018-05-17'])
+def test_point_in_time_without_transaction_time_matches_now(shortened_stop, valid_time):
+    omitted = shortened_stop.point_in_time_query('Eyal', 'Rothman', '11218-5', valid_time)
+    explicit = shortened_stop.point_in_time_query('Eyal', 'Rothman', '11218-5', valid_time, _now())
+    assert omitted == explicit
+
+def test_older_version_still_valid_after_shortened_stop(shortened_stop):
+    assert shortened_stop.point_in_time_query('Eyal', 'Rothman', '11218-5', '2018-05-17 12:00')['value'] == 1.0
+
+def test_batch_rows_do_not_depend_on_each_other(shortened_stop):
+    query = {'first_name': 'Eyal', 'last_name': 'Rothman', 'loinc_code': '11218-5', 'valid_time': '2018-05-17 12:00'}
+    alone = shortened_stop.point_in_time_batch(pd.DataFrame([query]))
+    mixed = shortened_stop.point_in_time_batch(pd.DataFrame([dict(query, transaction_time=None), dict(query, transaction_time=_now())]))
+    assert alone.iloc[0]['value'] == mixed.iloc[0]['value'] == mixed.iloc[1]['value'] == 1.0
+
+def test_latest_only_history_drops_superseded_versions(shortened_stop):
+    result = shortened_stop.history_query('Eyal', 'Rothman', '11218-5', latest_only=True)
+    assert sorted(record['value'] for record in result['data']) == [2.0, 3.0]
+    assert shortened_stop.history_query('Eyal', 'Rothman', '11218-5')['count'] == 3
+
+def test_rows_without_transaction_time_do_not_supersede(tmp_path):
+    engine = _engine(tmp_path, _rows(('Eyal', 'Rothman', '11218-5', 1.0, 'x', '2018-05-17 10:00', None, '2018-05-17 12:00'),
+                                     ('Eyal', 'Rothman', '11218-5', 2.0, 'x', '2018-05-17 10:00', None, 'not a date')))
+    omitted = engine.point_in_time_query('Eyal', 'Rothman', '11218-5', '2018-05-17 12:00')
+    assert omitted == engine.point_in_time_query('Eyal', 'Rothman', '11218-5', '2018-05-17 12:00', _now())
+    assert omitted['value'] == 1.0
+    assert engine.history_query('Eyal', 'Rothman', '11218-5', latest_only=True) == \
+           engine.history_query('Eyal', 'Rothman', '11218-5', transaction_time=_now(), latest_only=True)
+
+def test_synthetic_queries_match_now(tmp_path):
+    raw = generate_dataset(5000, correction_rate=0.3, seed=7)
+    rng = np.random.default_rng(7)
+    # Give some measurements (and some corrections) a bounded validity
+    stops = raw['Valid start time'] + pd.to_timedelta(rng.integers(10, 600, len(raw)), unit='m')
+    raw.insert(6, 'Valid stop time', stops.where(rng.random(len(raw)) < 0.5))
+    engine = _engine(tmp_path, raw)
+    sample = raw.sample(300, random_state=7)
+    now = _now()
+    queries = pd.DataFrame({'first_name': sample['First name'], 'last_name': sample['Last name'], 'loinc_code': sample['LOINC-NUM'],
+                            'valid_time': (sample['Valid start time'] + pd.Timedelta(minutes=30)).dt.strftime('%Y-%m-%d %H:%M')})
+    queries.loc[queries.index[::3], 'valid_time'] = sample['Valid start time'].iloc[::3].dt.strftime('%Y-%m-%d')
+    for q in queries.itertuples(index=False):
+        assert engine.point_in_time_query(q.first_name, q.last_name, q.loinc_code, q.valid_time) == \
+               engine.point_in_time_query(q.first_name, q.last_name, q.loinc_code, q.valid_time, now)
+        assert engine.history_query(q.first_name, q.last_name, q.loinc_code, latest_only=True) == \
+               engine.history_query(q.first_name, q.last_name, q.loinc_code, transaction_time=now, latest_only=True)
+    omitted = engine.point_in_time_batch(queries)
+    explicit = engine.point_in_time_batch(queries.assign(transaction_time=now))
+    pd.testing.assert_frame_equal(omitted, explicit)
@@ -0,0 +1,26 @@
+"""Traces attached to query results while profiling with attach_traces."""
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from temporal_db.data_manager import LoincManager, TemporalDataManager
+from temporal_db.profiling import Profiler
+from temporal_db.query_engine import TemporalQueryEngine
+
+COLUMNS = ['First name', 'Last name', 'LOINC-NUM', 'Value', 'Unit', 'Valid start time', 'Valid stop time', 'Transaction time']
+QUERY = {'first_name': 'Eyal', 'last_name': 'Rothman', 'loinc_code': '11218-5', 'valid_time': '2018-05-17 12:00'}
+
+def test_traces_are_attached(tmp_path):
+    path = os.path.join(tmp_path, 'data.csv')
+    pd.DataFrame([('Eyal', 'Rothman', '11218-5', 1.0, 'x', '2018-05-17 10:00', None, '2018-05-17 12:00')], columns=COLUMNS).to_csv(path, index=False)
+    loinc_manager = LoincManager(os.path.join(tmp_path, 'missing_loinc.csv'))
+    profiler = Profiler(enabled=True, attach_traces=True)
+    data_manager = TemporalDataManager(path, loinc_manager, use_snapshot=False, use_log=False, profiler=profiler)
+    engine = TemporalQueryEngine(data_manager, loinc_manager, cache_entries=0)
+
+    assert engine.point_in_time_query(**QUERY)['trace']['operation'] == 'point_in_time_query'
+    batch = engine.point_in_time_batch(pd.DataFrame([QUERY]))
+    assert batch.iloc[0]['value'] == 1.0 and 'trace' not in batch.columns
+    assert batch.attrs['trace']['operation'] == 'point_in_time_batch'
+    assert [stage['stage'] for stage in batch.attrs['trace']['stages']][0] == 'parse_times'
@@ -0,0 +1,108 @@
+"""
+End-to-end checks of the HTTP/JSON server: a real QueryServer on a free port, driven by a
+plain http.client / socket client.
+"""
+import asyncio
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from temporal_db.data_manager import LoincManager, TemporalDataManager
+from temporal_db.query_engine import TemporalQueryEngine
+from temporal_db.server import MAX_BODY_BYTES, QueryServer
+
+COLUMNS = ['First name', 'Last name', 'LOINC-NUM', 'Value', 'Unit', 'Valid start time', 'Valid stop time', 'Transaction time']
+QUERY = {'first_name': 'Eyal', 'last_name': 'Rothman', 'loinc_code': '11218-5', 'valid_time': '2018-05-17 12:00'}
+
+@pytest.fixture
+def server(tmp_path):
+    path = os.path.join(tmp_path, 'data.csv')
+    pd.DataFrame([('Eyal', 'Rothman', '11218-5', float(i), 'x', f'2018-05-{10 + i} 10:00', None, f'2018-05-{10 + i} 12:00') for i in range(5)],
+                 columns=COLUMNS).to_csv(path, index=False)
+    loinc_manager = LoincManager(os.path.join(tmp_path, 'missing_loinc.csv'))
+    data_manager = TemporalDataManager(path, loinc_manager, use_snapshot=False, use_log=False)
+    query_server = QueryServer(TemporalQueryEngine(data_manager, loinc_manager), port=0, workers=2)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(query_server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield query_server
+    asyncio.run_coroutine_threadsafe(_shutdown(query_server), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+async def _shutdown(query_server):
+    await query_server.close()
+    # Keep-alive connections outlive the listening socket; stop their handlers too
+    handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in handlers:
+        task.cancel()
+    await asyncio.gather(*handlers, return_exceptions=True)
+
+def _call(conn, method, path, body=None):
+    conn.request(method, path, body=None if body is None else json.dumps(body), headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+def _raw(server, request: bytes) -> bytes:
+    with socket.create_connection(('127.0.0.1', server.port), timeout=5) as sock:
+        sock.sendall(request)
+        chunks = []
+        while chunk := sock.recv(65536):
+            chunks.append(chunk)
+    return b''.join(chunks)
+
+def test_keep_alive_reuses_connection(server):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    assert _call(conn, 'GET', '/health') == (200, {'status': 'ok', 'records': 5, 'version': server.data_manager.version})
+    sock = conn.sock
+    assert _call(conn, 'POST', '/point_in_time', QUERY)[0] == 200
+    assert conn.sock is sock
+    conn.close()
+
+def test_point_in_time(server):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    status, payload = _call(conn, 'POST', '/point_in_time', QUERY)
+    assert status == 200 and payload['value'] == 4.0
+    status, payload = _call(conn, 'POST', '/point_in_time', dict(QUERY, transaction_time='2018-05-11 13:00'))
+    assert payload['value'] == 1.0
+    status, payload = _call(conn, 'POST', '/point_in_time', dict(QUERY, valid_time='not a date'))
+    assert status == 200 and payload == {'error': 'An unexpected error occurred: invalid valid_time or transaction_time.'}
+    status, payload = _call(conn, 'POST', '/point_in_time', {'first_name': 'Eyal'})
+    assert status == 400 and 'last_name' in payload['error']
+
+def test_history_paging(server):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    status, payload = _call(conn, 'POST', '/history', {'first_name': 'Eyal', 'last_name': 'Rothman', 'loinc_code': '11218-5', 'offset': 1, 'limit': 2})
+    assert status == 200 and payload['count'] == 5 and payload['offset'] == 1
+    assert len(payload['data']) == 2
+    status, payload = _call(conn, 'POST', '/history', {'first_name': 'Eyal', 'last_name': 'Rothman', 'loinc_code': '11218-5', 'offset': 4})
+    assert len(payload['data']) == 1
+
+def test_error_statuses(server):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    assert _call(conn, 'GET', '/nope')[0] == 404
+    assert _call(conn, 'GET', '/point_in_time')[0] == 405
+    assert _call(conn, 'POST', '/history', {'first_name': 'Eyal', 'bogus': 1})[0] == 400
+    conn.request('POST', '/history', body=b'{not json', headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    assert response.status == 400 and json.loads(response.read())['error'] == 'Request body is not valid JSON.'
+    assert _raw(server, b'POST /history HTTP/1.1\r\nContent-Length: -1\r\n\r\n').startswith(b'HTTP/1.1 400 ')
+    too_large = f'POST /history HTTP/1.1\r\nContent-Length: {MAX_BODY_BYTES + 1}\r\n\r\n'.encode('latin-1')
+    assert _raw(server, too_large).startswith(b'HTTP/1.1 413 ')
+
+def test_append(server, tmp_path):
+    path = os.path.join(tmp_path, 'added.csv')
+    pd.DataFrame([('Eyal', 'Rothman', '11218-5', 9.0, 'x', '2018-05-17 11:00', None, '2018-05-20 12:00')], columns=COLUMNS).to_csv(path, index=False)
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    status, payload = _call(conn, 'POST', '/append', {'file_path': path})
+    assert status == 200 and payload['success'] and payload['rows_added'] == 1
+    assert _call(conn, 'GET', '/health')[1]['records'] == 6
+    assert _call(conn, 'POST', '/point_in_time', QUERY)[1]['value'] == 9.0
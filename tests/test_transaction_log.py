@@ -0,0 +1,152 @@
+"""
+Durability of appended batches: the transaction log, its compacted snapshot, and what a
+restart recovers after a crash or a damaged file.
+"""
+import os
+import sys
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from temporal_db.data_manager import COMPACTED_DIR, LoincManager, TemporalDataManager
+
+COLUMNS = ['First name', 'Last name', 'LOINC-NUM', 'Value', 'Unit', 'Valid start time', 'Valid stop time', 'Transaction time']
+
+def _write(path, day: int, rows: int = 3) -> str:
+    pd.DataFrame([('Eyal', 'Rothman', '11218-5', float(day * 10 + i), 'x', f'2018-05-{day:02d} {10 + i}:00', None, f'2018-05-{day:02d} 20:00')
+                  for i in range(rows)], columns=COLUMNS).to_csv(path, index=False)
+    return path
+
+@pytest.fixture
+def store(tmp_path):
+    """Opens a manager over a small base file with its log in tmp_path/log; call again to restart."""
+    base = _write(os.path.join(tmp_path, 'base.csv'), 1)
+    loinc_manager = LoincManager(os.path.join(tmp_path, 'missing_loinc.csv'))
+    def open_manager(compact_every=2):
+        return TemporalDataManager(base, loinc_manager, use_snapshot=False, log_dir=os.path.join(tmp_path, 'log'), compact_every=compact_every)
+    open_manager.batch = lambda day: _write(os.path.join(tmp_path, f'batch{day}.csv'), day)
+    open_manager.log_dir = os.path.join(tmp_path, 'log')
+    return open_manager
+
+def _values(manager) -> list:
+    return manager.df['value'].tolist()
+
+@pytest.mark.parametrize('damaged', ['meta.json', 'col0_codes.npy'])
+def test_unreadable_compacted_rows_are_set_aside(store, damaged):
+    manager = store()
+    for day in (2, 3):
+        assert manager.append_data_from_file(store.batch(day))['success']
+    manager.close()
+    compacted = os.path.join(store.log_dir, COMPACTED_DIR)
+    with open(os.path.join(compacted, damaged), 'r+b') as f:
+        f.truncate(10)
+
+    restarted = store()
+    assert _values(restarted) == [10.0, 11.0, 12.0]
+    assert not os.path.exists(compacted) and os.path.isdir(compacted + '.corrupt')
+    # A later compaction writes a fresh snapshot and leaves the damaged one alone
+    for day in (4, 5):
+        restarted.append_data_from_file(store.batch(day))
+    assert os.path.isdir(compacted) and os.path.isdir(compacted + '.corrupt')
+    restarted.close()
+    assert _values(store()) == _values(restarted)
+
+def test_second_instance_is_read_only(store):
+    writer = store()
+    assert writer.append_data_from_file(store.batch(2))['success']
+    reader = store()
+    assert reader.log.read_only and _values(reader) == _values(writer)
+    result = reader.append_data_from_file(store.batch(3))
+    assert not result['success'] and 'in use by another process' in result['error']
+    assert writer.append_data_from_file(store.batch(3))['success']
+
+    writer.close()
+    reopened = store()
+    assert not reopened.log.read_only
+    assert reopened.append_data_from_file(store.batch(4))['success']
+    assert len(reopened.df) == 12
+
+def _segments(store) -> list:
+    return sorted(name for name in os.listdir(store.log_dir) if name.endswith('.seg'))
+
+def test_torn_tail_is_cut_off(store):
+    manager = store(compact_every=0)
+    for day in (2, 3):
+        manager.append_data_from_file(store.batch(day))
+    expected = _values(manager)
+    manager.close()
+    path = os.path.join(store.log_dir, _segments(store)[-1])
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 10)
+
+    restarted = store(compact_every=0)
+    assert _values(restarted) == expected[:6] and restarted.log.last_sequence == 1
+    assert restarted.append_data_from_file(store.batch(4))['success']
+    restarted.close()
+    assert _values(store(compact_every=0)) == expected[:6] + [40.0, 41.0, 42.0]
+
+def test_failed_write_is_rolled_back(store, monkeypatch):
+    import temporal_db.transaction_log as transaction_log
+    manager = store(compact_every=0)
+    manager.append_data_from_file(store.batch(2))
+    # The record reaches the segment, fsync fails, and so does cutting it off again
+    def failing_fsync(fd):
+        raise OSError("disk full")
+    def no_truncate(path, mode='r', *args, **kwargs):
+        if mode == 'r+b':
+            raise OSError("disk full")
+        return open(path, mode, *args, **kwargs)
+    monkeypatch.setattr(transaction_log.os, 'fsync', failing_fsync)
+    monkeypatch.setattr(transaction_log, 'open', no_truncate, raising=False)
+    result = manager.append_data_from_file(store.batch(3))
+    assert not result['success'] and manager.log._pending_rollback is not None
+    assert len(manager.df) == 6
+    monkeypatch.undo()
+
+    # The next append first cuts the leftover record off, so it is never replayed
+    assert manager.append_data_from_file(store.batch(4))['success']
+    assert manager.log._pending_rollback is None and manager.log.last_sequence == 2
+    manager.close()
+    assert _values(store(compact_every=0)) == _values(manager) == [10.0, 11.0, 12.0, 20.0, 21.0, 22.0, 40.0, 41.0, 42.0]
+
+def test_restart_after_compaction(store):
+    manager = store()
+    for day in range(2, 7):
+        manager.append_data_from_file(store.batch(day))
+    assert manager._compacted_sequence == 4 and _segments(store) == ['000000000005.seg']
+    manager.close()
+    restarted = store()
+    assert _values(restarted) == _values(manager) and restarted.log.last_sequence == 5
+    assert restarted.append_data_from_file(store.batch(7))['success']
+    restarted.close()
+    assert _values(store()) == _values(restarted)
+
+def test_interrupted_compaction_swap(store, monkeypatch):
+    manager = store()
+    for day in (2, 3, 4):
+        manager.append_data_from_file(store.batch(day))
+    # Crash between moving the previous snapshot aside and moving the new one in
+    calls, replace = [], os.replace
+    def interrupted_replace(src, dst):
+        calls.append(src)
+        if len(calls) == 2:
+            raise OSError("interrupted")
+        replace(src, dst)
+    monkeypatch.setattr(os, 'replace', interrupted_replace)
+    manager.append_data_from_file(store.batch(5))
+    monkeypatch.undo()
+    compacted = os.path.join(store.log_dir, COMPACTED_DIR)
+    assert not os.path.exists(compacted) and os.path.isdir(compacted + '.old') and os.path.isdir(compacted + '.tmp')
+    manager.close()
+
+    restarted = store()
+    assert _values(restarted) == _values(manager) and restarted._compacted_sequence == 4
+    assert not os.path.exists(compacted + '.old') and not os.path.exists(compacted + '.tmp')
+
+def test_compacted_rows_survive_a_changed_base_file(store, tmp_path):
+    manager = store()
+    for day in (2, 3):
+        manager.append_data_from_file(store.batch(day))
+    manager.close()
+    _write(os.path.join(tmp_path, 'base.csv'), 9, rows=2)
+    assert _values(store()) == [90.0, 91.0] + _values(manager)[3:]